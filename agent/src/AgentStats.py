@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+class _Timing:
+    __slots__ = ("count", "wall", "cpu", "max_wall")
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0  # 累计耗时（秒）
+        self.cpu = 0.0  # 累计 CPU 时间（秒），只统计执行线程自身
+        self.max_wall = 0.0  # 单次最长耗时（秒）
+
+class AgentStats:
+    def __init__(self):
+        """
+        初始化 Agent 自身的运行统计：各采集函数的耗时、发送时的等待时间、重连次数等。
+
+        耗时和计数按报告周期累计，每次 snapshot 后清零；gauge 记录的是最新值。
+        """
+        self.started = time.monotonic()
+        self.lock = threading.Lock()  # 采集函数在线程池中计时
+        self.timings = {}  # 名称 -> _Timing
+        self.counters = defaultdict(int)  # 名称 -> 计数
+        self.gauges = {}  # 名称 -> 最新值
+        self._period_start = self.started  # 当前报告周期的开始时间
+        self._process_time = time.process_time()  # 当前报告周期开始时进程的 CPU 时间
+
+    def record(self, name: str, wall: float, cpu: float = 0.0):
+        """
+        记录一次耗时。
+
+        :param name: 计时项名称
+        :param wall: 实际耗时（秒）
+        :param cpu: CPU 时间（秒）
+        """
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = _Timing()
+            timing.count += 1
+            timing.wall += wall
+            timing.cpu += cpu
+            timing.max_wall = max(timing.max_wall, wall)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        统计代码块的实际耗时和当前线程的 CPU 时间。
+
+        :param name: 计时项名称
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def timed(self, name: str, func):
+        """
+        返回一个对 func 计时的包装函数，用于提交到线程池。
+
+        :param name: 计时项名称
+        :param func: 被计时的函数
+        """
+        def _run(*args, **kwargs):
+            with self.timer(name):
+                return func(*args, **kwargs)
+        return _run
+
+    def incr(self, name: str, value: int = 1):
+        """
+        增加一个计数。
+
+        :param name: 计数项名称
+        :param value: 增加的值
+        """
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name: str, value):
+        """
+        记录一个瞬时值，例如队列深度。
+
+        :param name: 名称
+        :param value: 最新值
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        返回当前报告周期的统计并开始新的周期。
+
+        :return: {"uptime", "period", "cpu_percent", "timings", "counters", "gauges"}，耗时单位为毫秒，
+                 cpu_percent 为 Agent 进程在本周期内占用的 CPU（单核百分比）
+        """
+        now = time.monotonic()
+        with self.lock:
+            timings, self.timings = self.timings, {}
+            counters, self.counters = self.counters, defaultdict(int)
+            gauges = dict(self.gauges)
+            period, self._period_start = now - self._period_start, now
+            process_time = time.process_time()
+            cpu_time, self._process_time = process_time - self._process_time, process_time
+        return {
+            "uptime": round(now - self.started, 1),
+            "period": round(period, 1),
+            "cpu_percent": round(cpu_time / period * 100, 2) if period > 0 else 0.0,
+            "timings": {
+                name: {
+                    "count": timing.count,
+                    "wall_ms": round(timing.wall * 1000, 2),
+                    "cpu_ms": round(timing.cpu * 1000, 2),
+                    "avg_ms": round(timing.wall * 1000 / timing.count, 2),
+                    "max_ms": round(timing.max_wall * 1000, 2)
+                }
+                for name, timing in timings.items()
+            },
+            "counters": dict(counters),
+            "gauges": gauges
+        }
+
+    @staticmethod
+    def dump(stats: dict, path: str):
+        """
+        将统计写入本地文件，先写临时文件再替换，避免读取到写了一半的内容。
+
+        :param stats: snapshot 返回的统计
+        :param path: 文件路径
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(stats, f, indent=4)
+        os.replace(temp_path, path)
@@ -0,0 +1,74 @@
+import sys
+import time
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+COUNTER_WRAP_32 = 2 ** 32  # 32 位内核上网卡、磁盘计数器的回绕值
+# 网卡、磁盘计数器（/proc/net/dev、/proc/diskstats）在 64 位内核上是 64 位，实际不会回绕，
+# 只有 32 位内核按 2^32 回绕；以解释器的位数判断内核的位数
+DEVICE_COUNTER_WRAP = COUNTER_WRAP_32 if sys.maxsize < 2 ** 32 else None
+
+class CounterRates:
+    def __init__(self, wrap: int = None, resettable: bool = False):
+        """
+        初始化累计计数器的差值/速率换算器。
+
+        每次传入同一时刻读取的一组累计计数器（键 -> 计数器元组），返回与上次读取之间的差值。
+        消失的键（网卡、磁盘被移除）在本次读取后清除，新出现的键从下一次读取开始计算。
+
+        计数器变小时：指定 wrap 且上次的值小于 wrap 时按回绕计算，回绕后的差值不合理（超过 wrap 的一半）
+        时视为计数器被重置；计数器被重置时本次不返回该键，从下一次读取开始重新计算。
+        未指定 wrap 且不是 resettable 时差值按 0 计算（例如 Linux 的 iowait 偶尔回退）。
+
+        :param wrap: 计数器的回绕值（None 表示计数器不会回绕）
+        :param resettable: 计数器可能被重置（设备重新插入、驱动重新加载），变小时视为重置而不是按 0 计算
+        """
+        self.wrap = wrap
+        self.resettable = resettable
+        self._last = {}  # 键 -> 上次读取的计数器
+        self._last_time = None  # 上次读取的时间
+
+    def _delta(self, current, previous):
+        if current >= previous:
+            return current - previous
+        if self.wrap is None and not self.resettable:
+            return 0
+        if self.wrap is not None and previous < self.wrap:
+            delta = current + self.wrap - previous
+            if delta < self.wrap // 2:
+                return delta
+        return None  # 计数器被重置
+
+    def update(self, counters: Dict[Hashable, Sequence], now: float = None) -> Tuple[float, Dict[Hashable, List]]:
+        """
+        记录一次读取，返回距上次读取的时间和每个键的差值。
+
+        :param counters: 键 -> 累计计数器元组
+        :param now: 读取时间（默认为当前的单调时间）
+        :return: (间隔秒数, 键 -> 差值列表)，首次读取时间隔为 0 且没有差值
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._last_time if self._last_time is not None else 0.0
+        deltas = {}
+        for key, values in counters.items():
+            previous = self._last.get(key)
+            if previous is None or len(previous) != len(values):
+                continue
+            delta = [self._delta(current, prev) for current, prev in zip(values, previous)]
+            if None not in delta:
+                deltas[key] = delta
+        self._last = dict(counters)
+        self._last_time = now
+        return elapsed, deltas
+
+    def rates(self, counters: Dict[Hashable, Sequence], now: float = None) -> Dict[Hashable, List[float]]:
+        """
+        记录一次读取，返回每个键每秒的增量。
+
+        :param counters: 键 -> 累计计数器元组
+        :param now: 读取时间（默认为当前的单调时间）
+        :return: 键 -> 每秒增量列表，首次出现的键不包含在内
+        """
+        elapsed, deltas = self.update(counters, now)
+        if elapsed <= 0:
+            return {}
+        return {key: [value / elapsed for value in delta] for key, delta in deltas.items()}
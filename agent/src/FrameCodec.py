@@ -0,0 +1,52 @@
+import json
+from typing import Any, List
+
+try:
+    import msgpack
+except ImportError:  # msgpack 为可选依赖，未安装时只能使用 JSON
+    msgpack = None
+
+class JsonCodec:
+    """JSON 文本帧编码（默认及回退编码）"""
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def decode(self, message) -> Any:
+        return json.loads(message)
+
+class MsgpackCodec:
+    """msgpack 二进制帧编码"""
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, message) -> Any:
+        return msgpack.unpackb(message, raw=False)
+
+CODECS = {JsonCodec.name: JsonCodec}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+
+def available_codecs(preferred: str = "json") -> List[str]:
+    """
+    返回本端支持的编码名称，按优先级排序，JSON 总是作为最后的回退。
+
+    :param preferred: 首选编码名称
+    :return: 编码名称列表
+    """
+    names = [preferred] if preferred in CODECS else []
+    names += [name for name in CODECS if name not in names and name != JsonCodec.name]
+    if JsonCodec.name not in names:
+        names.append(JsonCodec.name)
+    return names
+
+def get_codec(name: str):
+    """
+    按名称创建编码器，未知名称返回 JSON 编码器。
+
+    :param name: 编码名称
+    """
+    return CODECS.get(name, JsonCodec)()
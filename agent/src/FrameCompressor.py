@@ -0,0 +1,116 @@
+import base64
+import json
+import zlib
+from typing import Any
+from Logger import Logger
+
+# 高频采样窗口汇总的模板
+WINDOW_TEMPLATE = {"count": 0, "min": 0.0, "max": 0.0, "mean": 0.0, "last": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0}
+
+# 与 SystemInfoCollector 样本及上传消息结构一致的模板，用于构建静态压缩字典
+SCHEMA_TEMPLATE = {
+    "seq": 0,
+    "delta": True,
+    "batch": [{"sid": 0, "base": 0, "delta": [], "key": {
+        "timestamp": "1970-01-01 00:00:00",
+        "cpu": {"percent_usage": 0.0, "per_core": [0.0], "times": [0.0] * 8, "ctx_switches": 0.0, "interrupts": 0.0,
+                "window": WINDOW_TEMPLATE},
+        "memory": {"total": 0, "available": 0, "used": 0, "percent": 0.0, "window": WINDOW_TEMPLATE},
+        "disk": [{"mountpoint": "/", "total": 0, "used": 0, "free": 0, "percent": 0.0}],
+        "disk_io": {"sda": [0.0] * 5},
+        "network": {"eth0": {
+            "io_stats": {"upload_speed": 0.0, "download_speed": 0.0, "total_upload": 0, "total_download": 0,
+                         "window": {"upload_speed": WINDOW_TEMPLATE, "download_speed": WINDOW_TEMPLATE}}
+        }},
+        "processes": {
+            "total": 0,
+            "status": {"running": 0, "sleeping": 0, "idle": 0, "zombie": 0},
+            "top_cpu": [{"pid": 0, "name": "", "cpu_percent": 0.0, "memory_percent": 0.0}],
+            "top_memory": [{"pid": 0, "name": "", "cpu_percent": 0.0, "memory_percent": 0.0}]
+        }
+    }}]
+}
+
+MAX_DICTIONARY_SIZE = 32 * 1024  # deflate 窗口大小，字典超出部分无效
+
+def _skeleton(value: Any) -> Any:
+    """
+    保留样本的结构和字符串，将数值清零，作为字典内容。
+    """
+    if isinstance(value, dict):
+        return {key: _skeleton(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_skeleton(item) for item in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    return 0
+
+class FrameCompressor:
+    def __init__(self, logger: Logger, level: int = 6, dictionary: str = "static", report_every: int = 100):
+        """
+        初始化带共享字典的逐消息压缩器。
+
+        字典在认证时发送给服务端，每条消息独立压缩，不依赖之前的消息。
+
+        :param logger: 日志记录器
+        :param level: deflate 压缩级别（1-9）
+        :param dictionary: 字典类型，"static" 只使用样本模板，"trained" 额外加入首个样本中的
+                           本机字段（网卡名、挂载点等）
+        :param report_every: 每压缩多少条消息记录一次压缩率
+        """
+        self.logger = logger
+        self.level = level
+        self.mode = dictionary
+        self.report_every = report_every
+        self.dictionary = json.dumps(_skeleton(SCHEMA_TEMPLATE)).encode()
+        self.trained = False
+        self.raw_bytes = 0  # 压缩前的累计字节数
+        self.compressed_bytes = 0  # 压缩后的累计字节数
+        self.frames = 0  # 已压缩的消息数
+
+    def train(self, sample: dict):
+        """
+        使用首个真实样本训练字典，只在 "trained" 模式下生效且只训练一次。
+
+        :param sample: 系统信息样本
+        """
+        if self.mode != "trained" or self.trained:
+            return
+        # deflate 优先匹配距离近的内容，出现频率最高的本机字段放在字典末尾
+        trained = self.dictionary + json.dumps(_skeleton(sample)).encode()
+        self.dictionary = trained[-MAX_DICTIONARY_SIZE:]
+        self.trained = True
+        self.logger.info(f"Trained compression dictionary ({len(self.dictionary)} bytes)")
+
+    def handshake(self) -> dict:
+        """
+        返回认证消息中的压缩参数。
+        """
+        return {"method": "deflate", "dictionary": base64.b64encode(self.dictionary).decode()}
+
+    def compress(self, payload) -> bytes:
+        """
+        压缩一条消息。
+
+        :param payload: 编码后的消息（str 或 bytes）
+        :return: 压缩后的消息
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+        compressed = compressor.compress(payload) + compressor.flush()
+        self.raw_bytes += len(payload)
+        self.compressed_bytes += len(compressed)
+        self.frames += 1
+        if self.frames % self.report_every == 0:
+            self.logger.info(f"Compression ratio {self.ratio():.2f} over {self.frames} frames "
+                             f"({self.raw_bytes} -> {self.compressed_bytes} bytes)")
+        return compressed
+
+    def ratio(self) -> float:
+        """
+        返回累计压缩率（压缩前字节数 / 压缩后字节数）。
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return self.raw_bytes / self.compressed_bytes
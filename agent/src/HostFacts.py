@@ -0,0 +1,33 @@
+def merge_host_facts(sample: dict, host_facts: dict) -> dict:
+    """
+    将主机信息合并到不含主机信息的样本中，还原为完整的系统信息记录。
+
+    用于向不支持会话主机信息的旧版服务端上传，以及 SystemInfoCollector.get_full_system_info。
+
+    :param sample: 不含主机信息的样本（SystemInfoCollector.get_system_sample 的结构）
+    :param host_facts: 主机信息
+    :return: 完整的系统信息记录
+    """
+    if not host_facts or "platform" in sample:
+        return sample
+    devices = {part["mountpoint"]: part["device"] for part in host_facts["partitions"]}
+    network = sample.get("network", {})
+    return {
+        **sample,
+        "platform": host_facts["platform"],
+        "version": host_facts["version"],
+        "cpu": {
+            "physical_cores": host_facts["physical_cores"],
+            "logical_cores": host_facts["logical_cores"],
+            **sample.get("cpu", {})
+        },
+        "disk": [{"device": devices.get(disk["mountpoint"]), **disk} for disk in sample.get("disk", [])],
+        "network": {
+            interface: {
+                "addresses": addresses,
+                "io_stats": network.get(interface, {}).get("io_stats", {})
+            }
+            for interface, addresses in host_facts["interfaces"].items()
+        },
+        "boot_time": host_facts["boot_time"]
+    }
@@ -0,0 +1,132 @@
+import os
+import threading
+from Logger import Logger
+from SystemInfoCollector import SystemInfoCollector, CPU_TIME_FIELDS
+
+class ProcSystemInfoCollector(SystemInfoCollector):
+    """
+    Linux 专用的采集后端：直接读取 /proc 和 statvfs，复用打开的文件描述符，
+    不为每次采集创建 psutil 的 namedtuple，输出结构与 SystemInfoCollector 相同。
+    """
+
+    def __init__(self, logger: Logger, *args, **kwargs):
+        self._fds = {}  # /proc 文件路径 -> 文件描述符
+        self._fds_lock = threading.Lock()  # 多个采集线程可能同时首次打开同一个文件
+        self._buffer_sizes = {}  # /proc 文件路径 -> 读取缓冲区大小
+        super().__init__(logger, *args, **kwargs)
+
+    def _read_proc(self, path: str) -> bytes:
+        """
+        从头读取一个 /proc 文件的全部内容，文件描述符在多次读取之间保持打开。
+
+        :param path: /proc 文件路径
+        :return: 文件内容
+        """
+        fd = self._fds.get(path)
+        if fd is None:
+            with self._fds_lock:
+                fd = self._fds.get(path)
+                if fd is None:
+                    fd = self._fds[path] = os.open(path, os.O_RDONLY)
+        size = self._buffer_sizes.get(path, 4096)
+        while True:
+            data = os.pread(fd, size, 0)
+            if len(data) < size:
+                self._buffer_sizes[path] = size
+                return data
+            size *= 2  # 缓冲区不够大，加倍后重新读取
+
+    def close(self):
+        """
+        关闭采集线程池，待采集线程退出后关闭打开的 /proc 文件描述符。
+        """
+        super().close()
+        with self._fds_lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+    def _read_cpu_times(self):
+        """
+        读取 /proc/stat 的 cpu 行，返回 (总时间, 空闲时间)，单位为 jiffies。
+        """
+        line = self._read_proc("/proc/stat").split(b"\n", 1)[0]
+        times = [int(value) for value in line.split()[1:9]]
+        # user nice system idle iowait irq softirq steal，guest 已计入 user/nice
+        total = sum(times[:8])
+        idle = times[3] + times[4]
+        return total, idle
+
+    def _read_cpu_counters(self):
+        ticks = os.sysconf("SC_CLK_TCK")
+        counters = {}
+        switches = [0, 0]
+        for line in self._read_proc("/proc/stat").split(b"\n"):
+            if line.startswith(b"cpu"):
+                name, *fields = line.split()
+                # 与 psutil 一致，CPU 时间换算为秒
+                times = tuple(int(value) / ticks for value in fields[:len(CPU_TIME_FIELDS)])
+                counters["all" if name == b"cpu" else int(name[3:])] = times
+            elif line.startswith(b"ctxt "):
+                switches[0] = int(line.split()[1])
+            elif line.startswith(b"intr "):
+                switches[1] = int(line.split()[1])
+        counters["switches"] = tuple(switches)
+        return counters
+
+    def _read_disk_counters(self):
+        counters = {}
+        for line in self._read_proc("/proc/diskstats").split(b"\n"):
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            # 读完成次数、读扇区数、写完成次数、写扇区数、I/O 忙碌毫秒数，扇区固定为 512 字节
+            values = (int(fields[3]), int(fields[7]), int(fields[5]) * 512, int(fields[9]) * 512, int(fields[12]))
+            if any(values):
+                counters[fields[2].decode()] = values
+        return counters
+
+    def _get_memory_info(self):
+        self.logger.debug("Get memory info from /proc/meminfo")
+        values = {}
+        for line in self._read_proc("/proc/meminfo").split(b"\n"):
+            name, _, rest = line.partition(b":")
+            if name in (b"MemTotal", b"MemFree", b"MemAvailable", b"Buffers", b"Cached", b"SReclaimable"):
+                values[name] = int(rest.split()[0]) * 1024
+        total = values[b"MemTotal"]
+        free = values[b"MemFree"]
+        available = values.get(b"MemAvailable", free)
+        cached = values.get(b"Cached", 0) + values.get(b"SReclaimable", 0)
+        used = total - free - cached - values.get(b"Buffers", 0)
+        if used < 0:
+            used = total - free
+        return {
+            "total": total,
+            "available": available,
+            "used": used,
+            "percent": round((total - available) / total * 100, 1)
+        }
+
+    def _read_network_counters(self):
+        counters = {}
+        for line in self._read_proc("/proc/net/dev").split(b"\n")[2:]:
+            interface, sep, rest = line.partition(b":")
+            if not sep:
+                continue
+            fields = rest.split()
+            # 接收字节数为第 1 列，发送字节数为第 9 列
+            counters[interface.strip().decode()] = (int(fields[8]), int(fields[0]))
+        return counters
+
+    def _disk_usage(self, mountpoint: str):
+        st = os.statvfs(mountpoint)
+        total = st.f_blocks * st.f_frsize
+        used = total - st.f_bfree * st.f_frsize
+        free = st.f_bavail * st.f_frsize  # 普通用户可用空间
+        total_user = used + free
+        return {
+            "total": total,
+            "used": used,
+            "free": free,
+            "percent": round(used / total_user * 100, 1) if total_user else 0.0
+        }
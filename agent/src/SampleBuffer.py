@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import List
+from Logger import Logger
+
+class SampleBuffer:
+    def __init__(self, max_size: int, logger: Logger):
+        """
+        初始化有界环形样本缓冲区，缓冲区满时丢弃最旧的样本。
+
+        :param max_size: 最多缓存的样本数量
+        :param logger: 日志记录器
+        """
+        self.max_size = max_size
+        self.logger = logger
+        self.samples = deque()  # 元素为 (入队时间, 样本)
+        self.dropped = 0  # 因缓冲区满而丢弃的样本数
+        self._event = asyncio.Event()  # 有新样本入队时触发
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _drop_oldest(self):
+        self.samples.popleft()
+        self.dropped += 1
+        # 缓冲区满时每个样本都会触发，限制输出频率
+        self.logger.log_every(10, logging.WARNING, "Sample buffer full, dropped oldest sample (total dropped: %d)", self.dropped)
+
+    def push(self, sample: dict):
+        """
+        放入一个样本（不阻塞）。
+
+        :param sample: 系统信息样本
+        """
+        if len(self.samples) >= self.max_size:
+            self._drop_oldest()
+        self.samples.append((time.monotonic(), sample))
+        self._event.set()
+
+    def requeue(self, samples: List[dict]):
+        """
+        将发送失败的样本放回缓冲区头部，保持原有顺序。
+
+        :param samples: 发送失败的样本列表
+        """
+        now = time.monotonic()
+        for sample in reversed(samples):
+            if len(self.samples) >= self.max_size:
+                # 放回的样本比缓冲区中的都旧，直接丢弃
+                self.dropped += 1
+                self.logger.log_every(10, logging.WARNING, "Sample buffer full, dropped requeued sample (total dropped: %d)", self.dropped)
+                continue
+            self.samples.appendleft((now, sample))
+        if self.samples:
+            self._event.set()
+
+    def pop_batch(self, max_size: int) -> List[dict]:
+        """
+        从缓冲区头部取出最多 max_size 个样本。
+
+        :param max_size: 批次最大样本数
+        :return: 样本列表
+        """
+        batch = []
+        while self.samples and len(batch) < max_size:
+            batch.append(self.samples.popleft()[1])
+        return batch
+
+    def oldest_age(self) -> float:
+        """
+        返回缓冲区中最旧样本的等待时长（秒），缓冲区为空时返回 0。
+        """
+        if not self.samples:
+            return 0.0
+        return time.monotonic() - self.samples[0][0]
+
+    async def wait_for_batch(self, batch_size: int, max_age: float):
+        """
+        等待直到缓冲区中积累了 batch_size 个样本，或最旧样本等待超过 max_age 秒。
+
+        :param batch_size: 触发发送的样本数量
+        :param max_age: 触发发送的最长等待时间（秒）
+        """
+        while True:
+            if len(self.samples) >= batch_size:
+                return
+            timeout = None
+            if self.samples:
+                timeout = max_age - self.oldest_age()
+                if timeout <= 0:
+                    return
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
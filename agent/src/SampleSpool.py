@@ -0,0 +1,234 @@
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+from collections import deque
+from typing import List, Tuple
+from Logger import Logger
+
+_HEADER = struct.Struct("<II")  # 记录头：数据长度, CRC32
+_SEGMENT_NAME = re.compile(r"spool-(\d+)\.seg")
+
+class _Segment:
+    def __init__(self, directory: str, index: int, size: int):
+        """
+        打开（或创建）一个预分配大小的段文件并映射到内存。
+
+        :param directory: 缓冲区目录
+        :param index: 段编号
+        :param size: 段文件大小（字节）
+        """
+        self.index = index
+        self.path = os.path.join(directory, f"spool-{index}.seg")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)  # 映射保留自己的引用
+        self.end = self._scan()  # 有效数据的结束位置
+
+    def _scan(self) -> int:
+        """
+        从头扫描有效记录，遇到空记录或校验失败（写入中断）时停止。
+        """
+        offset = 0
+        for _, offset in self.records(0, len(self.map)):
+            pass
+        return offset
+
+    def records(self, offset: int, end: int = None):
+        """
+        依次返回 offset 之后的记录及下一条记录的位置。
+
+        :param offset: 起始位置
+        :param end: 结束位置，默认为有效数据的结束位置
+        """
+        end = self.end if end is None else end
+        while offset + _HEADER.size <= end:
+            length, crc = _HEADER.unpack_from(self.map, offset)
+            start = offset + _HEADER.size
+            if length == 0 or start + length > end:
+                return
+            payload = self.map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                return
+            offset = start + length
+            yield payload, offset
+
+    def append(self, payload: bytes) -> bool:
+        """
+        追加一条记录，空间不足时返回 False。
+
+        :param payload: 记录数据
+        """
+        size = _HEADER.size + len(payload)
+        if self.end + size > len(self.map):
+            return False
+        _HEADER.pack_into(self.map, self.end, len(payload), zlib.crc32(payload))
+        self.map[self.end + _HEADER.size:self.end + size] = payload
+        self.end += size
+        return True
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+    def remove(self):
+        self.map.close()
+        os.remove(self.path)
+
+class SampleSpool:
+    def __init__(self, directory: str, logger: Logger, segment_size: int = 1024 * 1024, max_size: int = 64 * 1024 * 1024):
+        """
+        初始化磁盘样本缓冲区，连接不可用时保存无法发送的样本，Agent 重启后仍然保留。
+
+        样本以带校验的记录顺序追加到内存映射的段文件中，读取位置保存在 spool.pos 中；
+        段文件总大小超过 max_size 时删除最旧的段。
+
+        :param directory: 缓冲区目录
+        :param logger: 日志记录器
+        :param segment_size: 每个段文件的大小（字节）
+        :param max_size: 所有段文件的总大小上限（字节）
+        """
+        self.directory = directory
+        self.logger = logger
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_size // segment_size)
+        self.evicted = 0  # 因超出大小上限而丢弃的样本数
+        os.makedirs(directory, exist_ok=True)
+        indices = sorted(
+            int(match.group(1)) for match in map(_SEGMENT_NAME.fullmatch, os.listdir(directory)) if match
+        )
+        self.segments = deque(_Segment(directory, index, segment_size) for index in indices)
+        if not self.segments:
+            self.segments.append(_Segment(directory, 0, segment_size))
+        self._position_path = os.path.join(directory, "spool.pos")
+        self.read_segment, self.read_offset = self._load_position()  # 下一条未发送记录的位置
+        if self.pending():
+            self.logger.info(f"Spool has {self.pending_bytes()} bytes of unsent samples")
+
+    def _load_position(self) -> Tuple[int, int]:
+        try:
+            with open(self._position_path, "r") as f:
+                position = json.load(f)
+            segment, offset = position["segment"], position["offset"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return self.segments[0].index, 0
+        if segment < self.segments[0].index:
+            return self.segments[0].index, 0
+        return segment, offset
+
+    def _save_position(self):
+        temp_path = f"{self._position_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"segment": self.read_segment, "offset": self.read_offset}, f)
+        os.replace(temp_path, self._position_path)
+
+    def pending(self) -> bool:
+        """
+        是否还有未发送的样本。
+        """
+        last = self.segments[-1]
+        return self.read_segment < last.index or self.read_offset < last.end
+
+    def pending_bytes(self) -> int:
+        """
+        返回未发送样本占用的字节数。
+        """
+        return sum(
+            segment.end - (self.read_offset if segment.index == self.read_segment else 0)
+            for segment in self.segments if segment.index >= self.read_segment
+        )
+
+    def _new_segment(self):
+        self.segments[-1].flush()
+        self.segments.append(_Segment(self.directory, self.segments[-1].index + 1, self.segment_size))
+        while len(self.segments) > self.max_segments:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        segment = self.segments.popleft()
+        if segment.index >= self.read_segment:
+            offset = self.read_offset if segment.index == self.read_segment else 0
+            dropped = sum(1 for _ in segment.records(offset))
+            self.evicted += dropped
+            self.logger.warning(f"Spool full, dropped {dropped} oldest samples (total dropped: {self.evicted})")
+        segment.remove()
+        if self.read_segment <= segment.index:
+            self.read_segment, self.read_offset = self.segments[0].index, 0
+            self._save_position()
+
+    def append(self, samples: List[dict]):
+        """
+        追加样本并写回磁盘。
+
+        :param samples: 样本列表
+        """
+        capacity = self.segment_size - _HEADER.size
+        for sample in samples:
+            payload = json.dumps(sample).encode()
+            if len(payload) > capacity:
+                self.logger.warning(f"Sample of {len(payload)} bytes exceeds spool segment size, dropped")
+                continue
+            if not self.segments[-1].append(payload):
+                self._new_segment()
+                self.segments[-1].append(payload)
+        self.segments[-1].flush()
+
+    def read_batch(self, max_samples: int) -> Tuple[List[dict], Tuple[int, int]]:
+        """
+        从读取位置开始读取最多 max_samples 个样本，不移动读取位置。
+
+        :param max_samples: 最多读取的样本数
+        :return: (样本列表, 读取之后的位置)，发送成功后将位置传给 commit
+        """
+        samples = []
+        cursor = (self.read_segment, self.read_offset)
+        for segment in self.segments:
+            if segment.index < self.read_segment:
+                continue
+            offset = self.read_offset if segment.index == self.read_segment else 0
+            for payload, offset in segment.records(offset):
+                samples.append(json.loads(payload))
+                cursor = (segment.index, offset)
+                if len(samples) >= max_samples:
+                    return samples, cursor
+        if not samples:
+            # 读取位置之后没有可解析的记录（例如位置文件损坏），跳过剩余数据
+            cursor = (self.segments[-1].index, self.segments[-1].end)
+        return samples, cursor
+
+    def commit(self, cursor: Tuple[int, int]):
+        """
+        样本发送成功后移动读取位置，删除已经全部发送的段。
+
+        :param cursor: read_batch 返回的位置
+        """
+        self.read_segment, self.read_offset = cursor
+        while len(self.segments) > 1 and (
+            self.segments[0].index < self.read_segment
+            or (self.segments[0].index == self.read_segment and self.read_offset >= self.segments[0].end)
+        ):
+            self.segments.popleft().remove()
+            if self.segments[0].index > self.read_segment:
+                self.read_segment, self.read_offset = self.segments[0].index, 0
+        if not self.pending() and self.read_offset:
+            # 全部发送完毕，换一个空的段，避免段文件无限增长
+            self.segments.append(_Segment(self.directory, self.segments[-1].index + 1, self.segment_size))
+            self.segments.popleft().remove()
+            self.read_segment, self.read_offset = self.segments[0].index, 0
+        self._save_position()
+
+    def close(self):
+        """
+        写回并关闭所有段文件。
+        """
+        for segment in self.segments:
+            segment.flush()
+            segment.close()
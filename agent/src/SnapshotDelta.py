@@ -0,0 +1,86 @@
+from typing import Any, List, Optional
+
+def diff_snapshot(base: Any, current: Any, path: Optional[list] = None, ops: Optional[list] = None) -> list:
+    """
+    计算两个快照之间的字段级差异。
+
+    差异为操作列表：[路径, 新值] 表示设置字段，[路径] 表示删除字段，
+    路径是由字典键和列表下标组成的列表。
+
+    :param base: 基准快照
+    :param current: 当前快照
+    :return: 差异操作列表
+    """
+    if path is None:
+        path = []
+    if ops is None:
+        ops = []
+    if isinstance(base, dict) and isinstance(current, dict):
+        for key, value in current.items():
+            if key in base:
+                diff_snapshot(base[key], value, path + [key], ops)
+            else:
+                ops.append([path + [key], value])
+        for key in base:
+            if key not in current:
+                ops.append([path + [key]])
+    elif isinstance(base, list) and isinstance(current, list) and len(base) == len(current):
+        for index, (old, new) in enumerate(zip(base, current)):
+            diff_snapshot(old, new, path + [index], ops)
+    elif base != current or type(base) is not type(current):
+        ops.append([path, current])
+    return ops
+
+class DeltaEncoder:
+    def __init__(self, keyframe_interval: int = 20):
+        """
+        初始化快照差分编码器。
+
+        差分总是基于服务端已确认的最新快照计算，没有已确认快照或距离上一个关键帧
+        已发送 keyframe_interval 个差分时发送完整的关键帧。
+
+        :param keyframe_interval: 两个关键帧之间最多的差分数量
+        """
+        self.keyframe_interval = keyframe_interval
+        self.next_sid = 1  # 下一个快照编号
+        self.base_sid = None  # 已确认的基准快照编号
+        self.base = None  # 已确认的基准快照
+        self.sent = {}  # 已发送但未确认的快照：编号 -> 快照
+        self.since_keyframe = 0  # 距离上一个关键帧发送的差分数量
+
+    def reset(self):
+        """
+        清空编码状态，在新连接上重新从关键帧开始。
+        """
+        self.base_sid = None
+        self.base = None
+        self.sent.clear()
+        self.since_keyframe = 0
+
+    def encode(self, sample: dict) -> dict:
+        """
+        编码一个样本。
+
+        :param sample: 完整的系统信息样本
+        :return: 关键帧 {"sid", "key"} 或差分帧 {"sid", "base", "delta"}
+        """
+        sid = self.next_sid
+        self.next_sid += 1
+        self.sent[sid] = sample
+        if self.base is None or self.since_keyframe >= self.keyframe_interval:
+            self.since_keyframe = 0
+            return {"sid": sid, "key": sample}
+        self.since_keyframe += 1
+        return {"sid": sid, "base": self.base_sid, "delta": diff_snapshot(self.base, sample)}
+
+    def acknowledge(self, sid: int):
+        """
+        服务端确认收到编号不大于 sid 的快照后，将其设为新的基准快照。
+
+        :param sid: 已确认的最大快照编号
+        """
+        if sid in self.sent:
+            self.base_sid = sid
+            self.base = self.sent[sid]
+        for old_sid in [s for s in self.sent if s <= sid]:
+            del self.sent[old_sid]
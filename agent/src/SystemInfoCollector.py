@@ -3,79 +3,163 @@ import psutil
 from datetime import datetime, timezone
 import socket
 import json
-from collections import deque
 from Logger import Logger
+from WindowAggregator import WindowAggregator
+from AgentStats import AgentStats
+from CounterRates import CounterRates, DEVICE_COUNTER_WRAP
+from HostFacts import merge_host_facts
 import time
-from collections import defaultdict, deque
+import heapq
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+
+# 可按不同周期采集的指标族，对应保存最新值的属性
+METRIC_FAMILIES = {
+    "cpu": "_cpu_info",
+    "memory": "_memory_info",
+    "disk": "_disk_info",
+    "disk_io": "_disk_io",
+    "network": "_network_info",
+    "processes": "_processes"
+}
+
+# cpu["times"] 中各项 CPU 时间占比的顺序
+CPU_TIME_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal")
+
+# disk_io 中每个磁盘的数组顺序：读/写次数每秒、读/写字节数每秒、忙碌时间占比
+DISK_IO_FIELDS = ("read_iops", "write_iops", "read_bytes", "write_bytes", "busy_percent")
 
 class SystemInfoCollector:
-    def __init__(self, logger: Logger):
+    def __init__(self, logger: Logger, host_facts_interval: float = 300, max_workers: int = 4, top_processes: int = 5, stats: AgentStats = None):
+        """
+        初始化系统信息采集器。
+
+        平台、系统版本、CPU 核数、启动时间、分区列表和网卡地址等很少变化的信息作为主机信息（host facts）
+        缓存，每 host_facts_interval 秒或检测到网卡/分区变化时才重新获取；其余指标每次采集都更新。
+
+        :param logger: 日志记录器
+        :param host_facts_interval: 主机信息的刷新间隔（秒）
+        :param max_workers: 并发执行采集函数的线程数
+        :param top_processes: 按 CPU 和内存分别上报的进程数量
+        :param stats: Agent 运行统计，记录各采集函数的耗时（None 表示不统计）
+        """
         self._platform = None
-        self._version = None
         self._cpu_info = None
         self._memory_info = None
         self._disk_info = None
+        self._disk_io = None
         self._network_info = None
-        self._boot_time = None
         self._processes = None
+        self._timestamp = None
         self.logger = logger
-        self._network_io_history = defaultdict(deque)  # 用于存储每个网卡的 I/O 历史数据
+        self.stats = stats
+        self._network_rates = CounterRates(wrap=DEVICE_COUNTER_WRAP, resettable=True)  # 网卡收发字节数 -> 速率
+        self._disk_io_rates = CounterRates(wrap=DEVICE_COUNTER_WRAP, resettable=True)  # 磁盘 I/O 计数 -> 速率
+        self._cpu_rates = CounterRates()  # CPU 时间、上下文切换和中断次数 -> 差值
+        self.host_facts_interval = host_facts_interval
+        self.host_facts_version = 0  # 主机信息每次变化时加一
+        self._host_facts = None
+        self._host_facts_time = 0.0  # 上次获取主机信息的时间
+        self._host_facts_stale = True  # 检测到网卡或分区变化时置位
+        self._known_interfaces = None  # 上次刷新主机信息后看到的网卡集合
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="collector")  # 采集线程池
+        self._disk_io_rates.update(self._read_disk_counters())
+        # psutil.cpu_percent(interval=None) 按线程记录上次的 CPU 时间，在线程池中调用结果不可靠，
+        # 因此由采集器自己保存上次的 CPU 时间，每次采集返回距上次采集期间的 CPU 使用率
+        self._cpu_rates.update(self._read_cpu_counters())
+        self.top_processes = top_processes
+        self._process_cache = {}  # PID -> (创建时间, 进程名, psutil.Process)，跨采集保留以计算 CPU 使用率
+        self._window = WindowAggregator()  # 高频采样的窗口聚合
+        self._fast_cpu_rates = CounterRates()  # 高频采样的 CPU 时间
+        self._fast_cpu_rates.update({"cpu": self._read_cpu_times()})
+        self._fast_network_rates = CounterRates(wrap=DEVICE_COUNTER_WRAP, resettable=True)  # 高频采样的网卡收发字节数
+
+    def _read_network_counters(self):
+        """
+        返回每个网卡的累计收发字节数：网卡名 -> (发送字节数, 接收字节数)。
+        """
+        return {
+            interface: (counters.bytes_sent, counters.bytes_recv)
+            for interface, counters in psutil.net_io_counters(pernic=True).items()
+        }
+
+    def _disk_usage(self, mountpoint: str):
+        """
+        返回分区的使用情况，分区不可用时抛出 OSError。
+        """
+        usage = psutil.disk_usage(mountpoint)
+        return {"total": usage.total, "used": usage.used, "free": usage.free, "percent": usage.percent}
+
+    def _read_disk_counters(self):
+        """
+        返回每个磁盘的累计 I/O 计数：设备名 -> (读次数, 写次数, 读字节数, 写字节数, 忙碌毫秒数)，
+        忽略从未有过 I/O 的设备。
+        """
+        counters = {}
+        for device, io in (psutil.disk_io_counters(perdisk=True) or {}).items():
+            # busy_time 只在 Linux 上提供，其他平台用读写耗时近似
+            busy = getattr(io, "busy_time", io.read_time + io.write_time)
+            values = (io.read_count, io.write_count, io.read_bytes, io.write_bytes, busy)
+            if any(values):
+                counters[device] = values
+        return counters
+
+    def _read_cpu_counters(self):
+        """
+        返回 CPU 相关的累计计数："all" 和每个核心编号 -> 按 CPU_TIME_FIELDS 顺序的 CPU 时间，
+        "switches" -> (上下文切换次数, 中断次数)。
+        """
+        def _fields(times):
+            return tuple(getattr(times, field, 0.0) for field in CPU_TIME_FIELDS)
+
+        counters = {"all": _fields(psutil.cpu_times())}
+        for core, times in enumerate(psutil.cpu_times(percpu=True)):
+            counters[core] = _fields(times)
+        stats = psutil.cpu_stats()
+        counters["switches"] = (stats.ctx_switches, stats.interrupts)
+        return counters
 
     def _get_network_io_stats(self):
         self.logger.debug("Get network I/O stats per interface")
-        io_counters = psutil.net_io_counters(pernic=True)  # 获取每个网卡的 I/O 统计信息
-        current_time = time.time()
+        io_counters = self._read_network_counters()  # 获取每个网卡的 I/O 统计信息
+        rates = self._network_rates.rates(io_counters)
         network_io_stats = {}
-
-        for interface, counters in io_counters.items():
-            self._network_io_history[interface].append((current_time, counters.bytes_sent, counters.bytes_recv))
-            
-            if len(self._network_io_history[interface]) == 2:
-                prev_time, prev_sent, prev_recv = self._network_io_history[interface][0]
-                curr_time, curr_sent, curr_recv = self._network_io_history[interface][1]
-                time_diff = curr_time - prev_time
-                sent_diff = curr_sent - prev_sent
-                recv_diff = curr_recv - prev_recv
-
-                upload_speed = sent_diff / time_diff  # 上传速度 (bytes/s)
-                download_speed = recv_diff / time_diff  # 下载速度 (bytes/s)
-                # self.logger.info(f"{upload_speed / 1024 / 1024}, {download_speed / 1024 / 1024}")
-                network_io_stats[interface] = {
-                    "upload_speed": upload_speed,
-                    "dwnload_speeod": download_speed,
-                    "total_upload": curr_sent,
-                    "total_download": curr_recv
-                }
-                self._network_io_history[interface].popleft()
-            else:
-                network_io_stats[interface] = {
-                    "upload_speed": 0,
-                    "download_speed": 0,
-                    "total_upload": counters.bytes_sent,
-                    "total_download": counters.bytes_recv
-                }
-
+        for interface, (bytes_sent, bytes_recv) in io_counters.items():
+            # 首次出现或计数器被重置的网卡速率为 0
+            upload_speed, download_speed = rates.get(interface, (0, 0))
+            network_io_stats[interface] = {
+                "upload_speed": upload_speed,  # 上传速度 (bytes/s)
+                "download_speed": download_speed,  # 下载速度 (bytes/s)
+                "total_upload": bytes_sent,
+                "total_download": bytes_recv
+            }
         return network_io_stats
 
     def _get_network_info(self):
         self.logger.debug("Get network info with I/O stats")
-        network = {}
         io_stats = self._get_network_io_stats()  # 获取每个网卡的 I/O 统计信息
+        interfaces = set(io_stats)
+        if self._known_interfaces is None:
+            self._known_interfaces = interfaces
+        elif interfaces != self._known_interfaces:
+            self.logger.info("Network interfaces changed")
+            self._host_facts_stale = True
+        return {interface: {"io_stats": stats} for interface, stats in io_stats.items()}
 
+    def _get_interface_addresses(self):
+        self.logger.debug("Get interface addresses")
+        interfaces = {}
         for interface, addrs in psutil.net_if_addrs().items():
-            network[interface] = {
-                "addresses": [],
-                "io_stats": io_stats.get(interface, {})  # 合并 I/O 统计信息
-            }
+            interfaces[interface] = []
             for addr in addrs:
                 if addr.family == socket.AF_INET:
-                    network[interface]["addresses"].append({
+                    interfaces[interface].append({
                         "ip": addr.address,
                         "netmask": addr.netmask,
                         "broadcast": addr.broadcast
                     })
-
-        return network
+        return interfaces
 
     def _get_os_version(self):
         self.logger.debug("Get os version")
@@ -88,12 +172,39 @@ class SystemInfoCollector:
         else:
             return "Unknown"
 
+    def _read_cpu_times(self):
+        """
+        返回 (总 CPU 时间, 空闲 CPU 时间)，空闲时间包含 iowait。
+        """
+        times = psutil.cpu_times()
+        # guest 时间已计入 user/nice
+        total = sum(times) - getattr(times, "guest", 0) - getattr(times, "guest_nice", 0)
+        idle = times.idle + getattr(times, "iowait", 0)
+        return total, idle
+
     def _get_cpu_info(self):
         self.logger.debug("Get cpu info")
+        # 不阻塞，基于两次采集间的 CPU 时间差
+        elapsed, deltas = self._cpu_rates.update(self._read_cpu_counters())
+
+        def _busy_percent(times):
+            total = sum(times)
+            if total <= 0:
+                return 0.0
+            idle = times[CPU_TIME_FIELDS.index("idle")] + times[CPU_TIME_FIELDS.index("iowait")]
+            return round(max(0.0, min(100.0, (total - idle) / total * 100)), 1)
+
+        times = deltas.get("all")
+        total = sum(times) if times else 0
+        switches = deltas.get("switches")
+        cores = sorted(key for key in deltas if isinstance(key, int))
         return {
-            "physical_cores": psutil.cpu_count(logical=False),
-            "logical_cores": psutil.cpu_count(logical=True),
-            "percent_usage": psutil.cpu_percent(interval=0.1)
+            "percent_usage": _busy_percent(times) if times else 0.0,
+            "per_core": [_busy_percent(deltas[core]) for core in cores],
+            # 按 CPU_TIME_FIELDS 顺序的 CPU 时间占比（%）
+            "times": [round(value / total * 100, 1) for value in times] if total > 0 else [],
+            "ctx_switches": round(switches[0] / elapsed, 1) if switches and elapsed > 0 else 0.0,
+            "interrupts": round(switches[1] / elapsed, 1) if switches and elapsed > 0 else 0.0
         }
 
     def _get_memory_info(self):
@@ -109,18 +220,39 @@ class SystemInfoCollector:
     def _get_disk_info(self):
         self.logger.debug("Get disk info")
         disks = []
-        for part in psutil.disk_partitions():
-            usage = psutil.disk_usage(part.mountpoint)
-            disks.append({
-                "device": part.device,
-                "mountpoint": part.mountpoint,
-                "total": usage.total,
-                "used": usage.used,
-                "free": usage.free,
-                "percent": usage.percent
-            })
+        for part in self._host_facts["partitions"]:
+            try:
+                usage = self._disk_usage(part["mountpoint"])
+            except OSError:
+                # 分区已被卸载
+                self.logger.info(f"Partition {part['mountpoint']} is no longer available")
+                self._host_facts_stale = True
+                continue
+            disks.append({"mountpoint": part["mountpoint"], **usage})
         return disks
 
+    def _get_disk_io_info(self):
+        self.logger.debug("Get disk I/O stats per device")
+        counters = self._read_disk_counters()
+        elapsed, deltas = self._disk_io_rates.update(counters)
+        if elapsed <= 0:
+            return {}
+        disk_io = {}
+        for device, (reads, writes, read_bytes, write_bytes, busy) in deltas.items():
+            # 按 DISK_IO_FIELDS 顺序的数组
+            disk_io[device] = [
+                round(reads / elapsed, 1),
+                round(writes / elapsed, 1),
+                round(read_bytes / elapsed, 1),
+                round(write_bytes / elapsed, 1),
+                round(min(100.0, busy / (elapsed * 1000) * 100), 1)
+            ]
+        return disk_io
+
+    def _get_partitions(self):
+        self.logger.debug("Get disk partitions")
+        return [{"device": part.device, "mountpoint": part.mountpoint} for part in psutil.disk_partitions()]
+
     def _get_boot_time(self):
         self.logger.debug("Get boot time")
         boot_timestamp = psutil.boot_time()
@@ -131,40 +263,194 @@ class SystemInfoCollector:
         return formatted_utc
 
     def _get_process_list(self):
+        """
+        增量更新进程表，返回进程总数、各状态的进程数以及 CPU 和内存占用最高的进程。
+        """
         self.logger.debug("Get process list")
-        processes = []
-        for proc in psutil.process_iter(["pid", "name", "cpu_percent", "memory_percent"]):
+        pids = psutil.pids()
+        alive = set(pids)
+        for pid in [pid for pid in self._process_cache if pid not in alive]:
+            del self._process_cache[pid]
+
+        stats = []  # (cpu_percent, memory_percent, pid, name)
+        status_counts = defaultdict(int)
+        for pid in pids:
             try:
-                processes.append({
-                    "pid": proc.info["pid"],
-                    "name": proc.info["name"],
-                    "cpu_percent": proc.info["cpu_percent"],
-                    "memory_percent": proc.info["memory_percent"]
-                })
-            except psutil.NoSuchProcess:
+                cached = self._process_cache.get(pid)
+                # Process 对象缓存了创建时间，is_running 重新读取并比较，PID 被复用时返回 False
+                if not cached or not cached[2].is_running():
+                    # 新进程或 PID 被复用，重新建立 CPU 使用率的基线
+                    proc = psutil.Process(pid)
+                    cached = (proc.create_time(), proc.name(), proc)
+                    self._process_cache[pid] = cached
+                proc = cached[2]
+                with proc.oneshot():  # 一次读取 /proc/<pid>/stat，供下面多个属性共用
+                    cpu_percent = proc.cpu_percent(interval=None)  # 基于上次采集以来的 CPU 时间差
+                    memory_percent = proc.memory_percent()
+                    status_counts[proc.status()] += 1
+                stats.append((cpu_percent, memory_percent, pid, cached[1]))
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self._process_cache.pop(pid, None)
                 continue
-        return processes
+
+        def _top(key):
+            return [
+                {"pid": pid, "name": name, "cpu_percent": cpu, "memory_percent": round(mem, 2)}
+                for cpu, mem, pid, name in heapq.nlargest(self.top_processes, stats, key=key)
+            ]
+
+        return {
+            "total": len(stats),
+            "status": dict(status_counts),
+            "top_cpu": _top(lambda item: item[0]),
+            "top_memory": _top(lambda item: item[1])
+        }
     
+    def refresh_host_facts(self, force: bool = False) -> bool:
+        """
+        在主机信息过期、检测到变化或 force 为 True 时重新获取主机信息。
+
+        :param force: 是否强制刷新
+        :return: 主机信息是否发生了变化
+        """
+        if not (force or self._host_facts_stale or self._host_facts is None
+                or time.monotonic() - self._host_facts_time >= self.host_facts_interval):
+            return False
+        self.logger.info("Refresh host facts")
+        self._platform = platform.system()
+        host_facts = {
+            "platform": self._platform,
+            "version": self._get_os_version(),
+            "physical_cores": psutil.cpu_count(logical=False),
+            "logical_cores": psutil.cpu_count(logical=True),
+            "boot_time": self._get_boot_time(),
+            "partitions": self._get_partitions(),
+            "interfaces": self._get_interface_addresses()
+        }
+        self._host_facts_time = time.monotonic()
+        self._host_facts_stale = False
+        self._known_interfaces = None
+        if host_facts == self._host_facts:
+            return False
+        self._host_facts = host_facts
+        self.host_facts_version += 1
+        return True
+
     def update_full_system_info(self):
         self.logger.info("Update full system info")
-        self._platform = platform.system()
-        self._version = self._get_os_version()
+        self.refresh_host_facts()
+        self._timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")  # 采集时间（UTC）
         self._cpu_info = self._get_cpu_info()
         self._memory_info = self._get_memory_info()
         self._disk_info = self._get_disk_info()
+        self._disk_io = self._get_disk_io_info()
         self._network_info = self._get_network_info()
-        self._boot_time = self._get_boot_time()
         self._processes = self._get_process_list()
+        # 本次采集发现网卡或分区变化时，立即刷新主机信息
+        self.refresh_host_facts()
+
+    async def collect(self, families=None):
+        """
+        在线程池中并发执行各个采集函数，不阻塞事件循环。
+
+        :param families: 本次需要采集的指标族（None 表示全部），其余指标族保留上次采集的值
+        """
+        families = list(METRIC_FAMILIES) if families is None else families
+        self.logger.info(f"Collect system info: {', '.join(families)}")
+        collectors = {
+            "cpu": self._get_cpu_info,
+            "memory": self._get_memory_info,
+            "disk": self._get_disk_info,
+            "disk_io": self._get_disk_io_info,
+            "network": self._get_network_info,
+            "processes": self._get_process_list
+        }
+        if self.stats:
+            # 在执行线程中计时，CPU 时间只包含采集函数本身
+            collectors = {
+                family: self.stats.timed(f"collector.{func.__name__.lstrip('_')}", func)
+                for family, func in collectors.items()
+            }
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.refresh_host_facts)
+        self._timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")  # 采集时间（UTC）
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, collectors[family]) for family in families)
+        )
+        for family, result in zip(families, results):
+            setattr(self, METRIC_FAMILIES[family], result)
+        # 本次采集发现网卡或分区变化时，立即刷新主机信息
+        await loop.run_in_executor(self.executor, self.refresh_host_facts)
+
+    def close(self):
+        """
+        关闭采集线程池，等待正在执行的采集完成。
+        """
+        self.executor.shutdown(wait=True)
+
+    def get_host_facts(self):
+        self.logger.info("Get host facts")
+        return self._host_facts
+
+    def sample_fast(self):
+        """
+        高频采样 CPU、内存和网卡速率，结果只计入窗口聚合，在 get_system_sample 时汇总上报。
+        """
+        _, deltas = self._fast_cpu_rates.update({"cpu": self._read_cpu_times()})
+        if "cpu" in deltas:
+            total, idle = deltas["cpu"]
+            if total > 0:
+                self._window.add("cpu", max(0.0, min(100.0, (total - idle) / total * 100)))
+
+        self._window.add("memory", self._get_memory_info()["percent"])
+
+        rates = self._fast_network_rates.rates(self._read_network_counters())
+        for interface, (upload_speed, download_speed) in rates.items():
+            self._window.add(("upload_speed", interface), upload_speed)
+            self._window.add(("download_speed", interface), download_speed)
+
+    def get_system_sample(self):
+        """
+        返回不含主机信息的样本，由服务端结合会话中的主机信息还原完整记录。
+        启用高频采样时，cpu、memory 和每个网卡的 io_stats 中附带上一个样本以来的窗口汇总（window）。
+        """
+        self.logger.info("Get system sample")
+        window = self._window.summarize()
+        cpu, memory, network = self._cpu_info, self._memory_info, self._network_info
+        if window:
+            # 生成新的字典，不修改之前样本共享的对象
+            if "cpu" in window:
+                cpu = {**cpu, "window": window["cpu"]}
+            if "memory" in window:
+                memory = {**memory, "window": window["memory"]}
+            network = {}
+            for interface, info in self._network_info.items():
+                upload = window.get(("upload_speed", interface))
+                download = window.get(("download_speed", interface))
+                if upload and download:
+                    info = {**info, "io_stats": {
+                        **info["io_stats"],
+                        "window": {"upload_speed": upload, "download_speed": download}
+                    }}
+                network[interface] = info
+        return {
+            "timestamp": self._timestamp,
+            "cpu": cpu,
+            "memory": memory,
+            "disk": self._disk_info,
+            "disk_io": self._disk_io,
+            "network": network,
+            "processes": self._processes
+        }
 
     def get_full_system_info(self):
         self.logger.info("Get full system info")
-        return {
-            "platform": self._platform,
-            "version": self._version,
+        return merge_host_facts({
+            "timestamp": self._timestamp,
             "cpu": self._cpu_info,
             "memory": self._memory_info,
             "disk": self._disk_info,
+            "disk_io": self._disk_io,
             "network": self._network_info,
-            "boot_time": self._boot_time,
-            "processes": len(self._processes)
-        }
\ No newline at end of file
+            "processes": self._processes
+        }, self._host_facts)
\ No newline at end of file
@@ -1,63 +1,385 @@
 import json
 import websockets
 import asyncio
+import random
+import time
+from collections import OrderedDict
 from Logger import Logger
+from SnapshotDelta import DeltaEncoder
+from FrameCodec import JsonCodec, available_codecs, get_codec
+from FrameCompressor import FrameCompressor
+from AgentStats import AgentStats
+from HostFacts import merge_host_facts
 
 class WebSocketUploader:
-    def __init__(self, server_url, secret, logger: Logger):
+    def __init__(self, server_url, secret, logger: Logger, window: int = 8, ack_timeout: float = 30, encoder: DeltaEncoder = None, wire_format: str = "json", compressor: FrameCompressor = None, stats: AgentStats = None, backoff_initial: float = 1, backoff_max: float = 60):
         self.server_url = server_url
         self.secret = secret
         self.logger = logger
         self.websocket = None  # 用于保存 WebSocket 连接
         self.lock = asyncio.Lock()  # 用于确保线程安全
+        self.window = window  # 最多允许的未确认消息数
+        self.ack_timeout = ack_timeout  # 发送窗口满时等待确认的最长时间（秒）
+        self.next_seq = 1  # 下一个消息的序列号
+        self.pending = OrderedDict()  # 已发送但未确认的消息：序列号 -> 样本列表
+        self._ack_task = None  # 接收确认消息的后台任务
+        self._window_event = asyncio.Event()  # 收到确认或连接断开时触发
+        self.encoder = encoder  # 快照差分编码器（None 表示发送完整样本）
+        self.frame_sids = {}  # 序列号 -> 该消息中最后一个快照编号
+        self.ack_callbacks = {}  # 序列号 -> 服务端确认该消息后调用的回调
+        self.wire_format = wire_format  # 首选的消息编码
+        self.codec = JsonCodec()  # 认证时协商得到的消息编码
+        self.legacy = False  # 旧版服务端：每条消息携带密钥和一个完整样本，逐条回复 "ack"
+        self._legacy_replies = 0  # 旧版服务端对最旧的未确认消息中已回复的样本数
+        self.compressor = compressor  # 带共享字典的消息压缩器（None 表示不压缩）
+        self.compressing = False  # 服务端是否接受了压缩
+        self.host_facts = None  # 主机信息，每个会话只发送一次
+        self._facts_dirty = False  # 主机信息在会话中发生了变化，需要重新发送
+        self.stats = stats  # Agent 运行统计（None 表示不统计）
+        self.sent_times = {}  # 序列号 -> 最近一次发送的时间，用于统计确认延迟
+        self.connections = 0  # 成功建立的连接数
+        self.session = None  # 服务端分配的会话令牌，重连时用于恢复会话
+        self.backoff_initial = backoff_initial  # 首次重连的最长等待时间（秒）
+        self.backoff_max = backoff_max  # 重连等待时间的上限（秒）
+        self._failures = 0  # 连续连接失败的次数
+        self._next_attempt = 0.0  # 允许下次连接的时间（事件循环时间）
+
+    def _schedule_retry(self, delay: float):
+        """
+        在 [0, delay] 秒内随机选择下次连接的时间，避免大量 Agent 同时重连。
+
+        :param delay: 最长等待时间（秒）
+        """
+        self._next_attempt = asyncio.get_running_loop().time() + random.uniform(0, delay)
+
+    def _backoff(self):
+        """
+        连接失败后指数退避：等待上限随连续失败次数加倍，直到 backoff_max。
+        """
+        self._schedule_retry(min(self.backoff_max, self.backoff_initial * 2 ** self._failures))
+        self._failures += 1
+
+    def retry_delay(self) -> float:
+        """
+        返回距离允许下次连接还需等待的时间（秒），已连接或可以立即连接时返回 0。
+        """
+        if self.websocket:
+            return 0.0
+        return max(0.0, self._next_attempt - asyncio.get_running_loop().time())
+
+    async def _authenticate(self):
+        """
+        发送完整的认证信息，同时提供支持的消息编码、压缩字典和主机信息，返回是否认证成功。
+        """
+        auth = {"secret": self.secret, "encodings": available_codecs(self.wire_format)}
+        if self.compressor:
+            auth["compression"] = self.compressor.handshake()
+        if self.host_facts:
+            auth["host_facts"] = self.host_facts
+        await self.websocket.send(json.dumps(auth))
+        response = await self.websocket.recv()
+        self.logger.debug(f"Connect response: {response}")
+        if response == "authenticated":
+            self._use_legacy_protocol()
+            return True
+        reply = self._parse_reply(response)
+        if reply.get("status") != "authenticated":
+            return False
+        # 连接已认证，后续消息不再重复携带密钥
+        self.codec = get_codec(reply.get("encoding"))
+        self.compressing = self.compressor is not None and reply.get("compression") == "deflate"
+        self.session = reply.get("session")
+        return True
+
+    async def _resume(self):
+        """
+        凭会话令牌恢复上次的会话，返回服务端已收到的最大序列号，会话已失效时返回 None。
+
+        会话只保存在服务端进程的内存中，只能跨越网络断开恢复；服务端重启后会话失效，需要重新完整认证。
+        """
+        await self.websocket.send(json.dumps({"secret": self.secret, "session": self.session}))
+        response = await self.websocket.recv()
+        if response == "authenticated":
+            # 旧版服务端只检查密钥，连接已认证，不需要再发送认证信息
+            self._use_legacy_protocol()
+            return None
+        reply = self._parse_reply(response)
+        self.logger.debug(f"Resume response: {reply}")
+        if reply.get("status") != "resumed":
+            self.logger.info("Session expired or server restarted, reconnecting with full authentication")
+            self.session = None
+            return None
+        return reply.get("ack", 0)
+
+    def _use_legacy_protocol(self):
+        """
+        旧版服务端只回复 "authenticated"：JSON 编码，每条消息携带密钥和一个完整样本，
+        不支持差分编码、压缩、主机信息和会话恢复。
+        """
+        self.logger.warning("Server only supports the legacy protocol, sending one full sample per message")
+        self.legacy = True
+        self.codec = JsonCodec()
+        self.compressing = False
+        self.session = None
+
+    @staticmethod
+    def _parse_reply(response) -> dict:
+        try:
+            reply = json.loads(response)
+        except (ValueError, TypeError):
+            return {}
+        return reply if isinstance(reply, dict) else {}
 
     async def connect(self):
-        """建立 WebSocket 连接"""
+        """建立 WebSocket 连接，有会话令牌时优先恢复会话"""
         self.logger.info(f"Create Connection to {self.server_url}")
         try:
-            self.websocket = await websockets.connect(self.server_url)
-            # 发送认证信息
-            auth_message = json.dumps({"secret": self.secret})
-            await self.websocket.send(auth_message)
-            response = await self.websocket.recv()
-            self.logger.debug(f"Connect response: {response}")
-            if response != "authenticated":
-                self.logger.error("Authentication failed")
-                await self.close()
-                return False
+            # 使用应用层压缩时关闭 permessage-deflate，避免重复压缩
+            self.websocket = await websockets.connect(
+                self.server_url, compression=None if self.compressor else "deflate"
+            )
+            if self._legacy_replies:
+                # 旧版服务端已回复了最旧消息中的部分样本，只重传其余的样本
+                seq = next(iter(self.pending))
+                self.pending[seq] = self.pending[seq][self._legacy_replies:]
+                self._legacy_replies = 0
+            self.legacy = False  # 每次连接重新判断，服务端可能已升级
+            resumed_ack = None
+            if self.session:
+                resumed_ack = await self._resume()
+                if resumed_ack is None and not self.legacy:
+                    # 会话已失效（通常是服务端重启），所有 Agent 会同时重连：随机等待后再完整认证，分散认证的压力
+                    self._schedule_retry(self.backoff_initial)
+                    await self.close()
+                    return False
+            if resumed_ack is None:
+                if not self.legacy and not await self._authenticate():
+                    self.logger.error("Authentication failed")
+                    self._backoff()
+                    await self.close()
+                    return False
+                self.logger.info(f"Authenticated, using {self.codec.name} encoding"
+                                 f"{' with compression' if self.compressing else ''}")
+                self._facts_dirty = False
+                if self.encoder:
+                    # 新会话中服务端没有基准快照，从关键帧重新开始
+                    self.encoder.reset()
+                    self.frame_sids.clear()
+            else:
+                # 恢复的会话保留了服务端的编码、字典、主机信息和差分基准，只需重传服务端未收到的消息
+                self.logger.info(f"Session resumed, server received up to seq {resumed_ack}")
+                self._acknowledge(resumed_ack)
+                if self.stats:
+                    self.stats.incr("upload.resumed_sessions")
+            self._failures = 0
+            self.connections += 1
+            if self.stats and self.connections > 1:
+                self.stats.incr("upload.reconnects")
+            self._ack_task = asyncio.create_task(self._receive_acks(self.websocket))
+            # 重传上次连接中未被确认的消息
+            if self.pending:
+                self.logger.info(f"Retransmit {len(self.pending)} unacknowledged messages")
+                if self.stats:
+                    self.stats.incr("upload.retransmitted_frames", len(self.pending))
+                for seq, samples in self.pending.items():
+                    await self._send_frame(seq, samples)
             return True
         except Exception as e:
             self.logger.error(f"WebSocket connection error: {e}")
+            if self.stats:
+                self.stats.incr("upload.connect_failures")
+            self._backoff()
             await self.close()
             return False
 
     async def close(self):
         """关闭 WebSocket 连接"""
-        if self.websocket:
-            await self.websocket.close()
-            self.websocket = None
+        # 先清空连接，接收确认的任务退出时不会当作被服务端断开
+        websocket, self.websocket = self.websocket, None
+        if self._ack_task:
+            self._ack_task.cancel()
+            self._ack_task = None
+        if websocket:
+            await websocket.close()
+        self._window_event.set()
+
+    async def _send_message(self, frame: dict):
+        if self.legacy:
+            frame["secret"] = self.secret
+        message = self.codec.encode(frame)
+        if self.compressing:
+            message = self.compressor.compress(message)
+        await self.websocket.send(message)
+
+    async def _send_frame(self, seq, samples):
+        if self.legacy:
+            # 旧版服务端每条消息只接受一个完整样本，不保存会话中的主机信息
+            for sample in samples:
+                await self._send_message({"data": merge_host_facts(sample, self.host_facts)})
+            self.sent_times[seq] = time.monotonic()
+            return
+        frame = {"seq": seq}
+        if self.encoder:
+            frame["batch"] = [self.encoder.encode(sample) for sample in samples]
+            frame["delta"] = True
+            self.frame_sids[seq] = frame["batch"][-1]["sid"]
+        else:
+            frame["batch"] = samples
+        await self._send_message(frame)
+        self.sent_times[seq] = time.monotonic()
+
+    def set_host_facts(self, host_facts: dict):
+        """
+        更新主机信息。新连接在认证消息中携带主机信息，已建立的连接在下次发送前补发。
+
+        :param host_facts: 主机信息
+        """
+        self.host_facts = host_facts
+        self._facts_dirty = True
+
+    def _acknowledge(self, ack: int):
+        """
+        移除序列号不大于 ack 的未确认消息，并推进差分编码的基准快照。
+
+        :param ack: 服务端已收到的最大序列号
+        """
+        now = time.monotonic()
+        while self.pending and next(iter(self.pending)) <= ack:
+            seq, _ = self.pending.popitem(last=False)
+            sent_time = self.sent_times.pop(seq, None)
+            if self.stats and sent_time is not None:
+                self.stats.record("upload.ack_latency", now - sent_time)
+            sid = self.frame_sids.pop(seq, None)
+            if sid is not None:
+                self.encoder.acknowledge(sid)
+            on_ack = self.ack_callbacks.pop(seq, None)
+            if on_ack:
+                on_ack()
+
+    async def _receive_acks(self, websocket):
+        """
+        接收服务端的累计确认：确认序列号 n 表示 n 及之前的消息均已收到。
+        """
+        try:
+            async for message in websocket:
+                if self.legacy:
+                    self._legacy_reply(message)
+                    continue
+                try:
+                    ack = self.codec.decode(message)["ack"]
+                except (ValueError, TypeError, KeyError):
+                    self.logger.error(f"Unexpected message from server: {message}")
+                    continue
+                self._acknowledge(ack)
+                self.logger.debug("Acknowledged up to seq %s, %d in flight", ack, len(self.pending))
+                self._window_event.set()
+        except websockets.exceptions.ConnectionClosed:
+            self.logger.info("Connection closed by server")
+        finally:
+            if self.websocket is websocket:
+                # 连接被服务端断开（例如服务端重启），随机等待一段时间再重连，避免所有 Agent 同时重连
+                self.websocket = None
+                self._ack_task = None
+                self._schedule_retry(self.backoff_initial)
+            self._window_event.set()
+
+    def _legacy_reply(self, message):
+        """
+        旧版服务端按发送顺序逐条回复，每个回复对应最旧的未确认消息中的下一个样本，
+        消息中的样本全部得到回复后确认该消息。
+
+        :param message: 服务端的回复（"ack" 或错误原因）
+        """
+        if not self.pending:
+            self.logger.error(f"Unexpected message from server: {message}")
+            return
+        if message != "ack":
+            # 服务端拒绝了该样本，重传也会得到相同的结果，丢弃
+            self.logger.error(f"Server rejected a sample: {message}")
+            if self.stats:
+                self.stats.incr("upload.rejected_samples")
+        seq, samples = next(iter(self.pending.items()))
+        self._legacy_replies += 1
+        if self._legacy_replies >= len(samples):
+            self._legacy_replies = 0
+            self._acknowledge(seq)
+        self._window_event.set()
+
+    async def _wait_for_window(self):
+        """等待发送窗口有空位，连接断开或超时时返回 False"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.ack_timeout
+        while len(self.pending) >= self.window:
+            if not self.websocket:
+                return False
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                self.logger.error(f"No acknowledgment within {self.ack_timeout}s, reconnecting")
+                await self.close()  # 关闭连接以便重试
+                return False
+            self._window_event.clear()
+            try:
+                await asyncio.wait_for(self._window_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return True
 
     async def send_data(self, data):
-        self.logger.info(f"Upload data to {self.server_url}")
-        """发送数据，如果未连接则先建立连接"""
+        """发送单个样本，如果未连接则先建立连接"""
+        return await self.send_batch([data])
+
+    async def send_batch(self, samples, on_ack=None):
+        """
+        在一个消息中批量发送多个样本，如果未连接则先建立连接。
+        发送不等待确认，返回 True 表示样本已进入发送窗口，未确认的部分会在重连后重传；
+        返回 False 表示样本未被接收，调用方需要稍后重试。
+
+        :param samples: 样本列表
+        :param on_ack: 服务端确认该消息后调用的回调（仅在返回 True 时有效）
+        """
+        self.logger.info("Upload %d samples to %s", len(samples), self.server_url)
+        lock_start = time.perf_counter()
         async with self.lock:  # 确保线程安全
+            if self.stats:
+                self.stats.record("upload.lock_wait", time.perf_counter() - lock_start)
             if not self.websocket:
+                if self.retry_delay() > 0:
+                    return False  # 仍在重连退避期内
+                if self.compressor:
+                    self.compressor.train(samples[0])
                 if not await self.connect():
                     return False
+            window_start = time.perf_counter()
+            window_ready = await self._wait_for_window()
+            if self.stats:
+                self.stats.record("upload.ack_wait", time.perf_counter() - window_start)
+            if not window_ready:
+                return False
+            if self._facts_dirty and self.legacy:
+                self._facts_dirty = False  # 旧版服务端：主机信息已合并到每个样本中
+            if self._facts_dirty:
+                try:
+                    await self._send_message({"facts": self.host_facts})
+                    self._facts_dirty = False
+                except Exception as e:
+                    self.logger.error(f"WebSocket send error: {e}")
+                    await self.close()  # 重连时在认证消息中发送
+                    return False
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending[seq] = samples
+            if on_ack:
+                self.ack_callbacks[seq] = on_ack
             try:
                 # 发送数据
-                message = json.dumps({"secret": self.secret, "data": data})
-                await self.websocket.send(message)
-                response = await self.websocket.recv()
-                self.logger.debug(f"Send response: {response}")
-                if response == "ack":
-                    self.logger.info("Data sent successfully")
-                    return True
-                else:
-                    self.logger.error(f"Failed to receive acknowledgment: {response}")
-                    await self.close()  # 关闭连接以便重试
-                    return False
+                await self._send_frame(seq, samples)
+                self.logger.info("Data sent with seq %d, %d in flight", seq, len(self.pending))
+                if self.stats:
+                    self.stats.incr("upload.frames")
+                    self.stats.incr("upload.samples", len(samples))
             except Exception as e:
                 self.logger.error(f"WebSocket send error: {e}")
-                await self.close()  # 关闭连接以便重试
-                return False
\ No newline at end of file
+                if self.stats:
+                    self.stats.incr("upload.send_errors")
+                await self.close()  # 关闭连接，重连后重传
+            return True
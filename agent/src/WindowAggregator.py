@@ -0,0 +1,78 @@
+import random
+import threading
+from typing import Dict, Hashable
+
+class _Window:
+    __slots__ = ("count", "total", "min", "max", "last", "reservoir")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.reservoir = []  # 用于估算分位数的均匀抽样
+
+class WindowAggregator:
+    def __init__(self, reservoir_size: int = 128):
+        """
+        初始化窗口聚合器，对窗口内的高频采样值计算 min/max/mean/last 和分位数。
+
+        min/max/mean/last 是精确值；分位数基于大小为 reservoir_size 的蓄水池抽样估算，
+        内存占用与采样频率无关。
+
+        :param reservoir_size: 每个指标最多保留的采样值数量
+        """
+        self.reservoir_size = reservoir_size
+        self.windows = {}  # 指标 -> _Window
+        self.lock = threading.Lock()  # 采样在采集线程中进行，汇总在事件循环中进行
+
+    def add(self, key: Hashable, value: float):
+        """
+        记录一个采样值。
+
+        :param key: 指标名
+        :param value: 采样值
+        """
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = _Window()
+            window.count += 1
+            window.total += value
+            window.min = value if window.min is None else min(window.min, value)
+            window.max = value if window.max is None else max(window.max, value)
+            window.last = value
+            if len(window.reservoir) < self.reservoir_size:
+                window.reservoir.append(value)
+            else:
+                index = random.randrange(window.count)
+                if index < self.reservoir_size:
+                    window.reservoir[index] = value
+
+    def summarize(self) -> Dict[Hashable, dict]:
+        """
+        返回当前窗口内每个指标的汇总并开始新的窗口。
+
+        :return: 指标 -> {"count", "min", "max", "mean", "last", "p50", "p90", "p99"}
+        """
+        with self.lock:
+            windows, self.windows = self.windows, {}
+        summary = {}
+        for key, window in windows.items():
+            values = sorted(window.reservoir)
+
+            def _percentile(q):
+                return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+            summary[key] = {
+                "count": window.count,
+                "min": round(window.min, 2),
+                "max": round(window.max, 2),
+                "mean": round(window.total / window.count, 2),
+                "last": round(window.last, 2),
+                "p50": _percentile(0.5),
+                "p90": _percentile(0.9),
+                "p99": _percentile(0.99)
+            }
+        return summary
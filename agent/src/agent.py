@@ -4,8 +4,18 @@ from SystemInfoCollector import SystemInfoCollector
 
 import asyncio
 import json
-from SystemInfoCollector import SystemInfoCollector
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from SystemInfoCollector import SystemInfoCollector, METRIC_FAMILIES
+from ProcSystemInfoCollector import ProcSystemInfoCollector
+import platform
+import psutil
 from WebSocketUploader import WebSocketUploader
+from SampleBuffer import SampleBuffer
+from SnapshotDelta import DeltaEncoder
+from FrameCompressor import FrameCompressor
+from AgentStats import AgentStats
+from SampleSpool import SampleSpool
 
 class MainApp:
     def __init__(self, config_file, logger:Logger):
@@ -13,37 +23,210 @@ class MainApp:
         self.logger.info("Read config file")
         with open(config_file, 'r') as f:
             self.config = json.load(f)
-        self.message_queue = asyncio.Queue(maxsize=1) # 定长队列
+        self.sample_buffer = SampleBuffer(self.config.get('buffer_size', 600), self.logger) # 有界环形缓冲区
+        self.batch_max_size = self.config.get('batch_max_size', 20)  # 单个消息的最大样本数
+        self.batch_max_age = self.config.get('batch_max_age', self.config['upload_interval'])  # 样本最长等待时间（秒）
+        # 磁盘缓冲区：连接不可用时保存发送失败的样本，连接恢复后限速补发
+        spool_config = self.config.get('spool', {})
+        self.spool = None
+        self.spool_executor = None  # 磁盘缓冲区的读写在单独的线程中依次执行，不阻塞事件循环
+        if spool_config.get('enabled', False):
+            self.spool_executor = ThreadPoolExecutor(max_workers=1)
+            self.spool = SampleSpool(
+                spool_config.get('directory', 'spool'), self.logger,
+                segment_size=spool_config.get('segment_size', 1024 * 1024),
+                max_size=spool_config.get('max_size', 64 * 1024 * 1024)
+            )
+        self.spool_batch_size = spool_config.get('drain_batch_size', 100)  # 补发时单个消息的最大样本数
+        self.spool_drain_rate = spool_config.get('drain_rate', 200)  # 补发速率上限（样本/秒）
+        # Agent 自身的运行统计，定期写入本地文件并可随样本上传
+        stats_config = self.config.get('agent_stats', {})
+        self.stats = AgentStats() if stats_config.get('enabled', False) else None
+        self.stats_interval = stats_config.get('interval', 60)  # 统计报告周期（秒）
+        self.stats_upload = stats_config.get('upload', False)  # 是否在样本中附带 agent_stats
+        self.stats_file = stats_config.get('dump_file')  # 本地统计文件（None 表示不写入）
         self.logger.info("Init SystemInfoCollector")
-        self.collector = SystemInfoCollector(self.logger)
+        collector_class = SystemInfoCollector
+        if self.config.get('collector_backend', 'psutil') == 'proc':
+            if platform.system() == 'Linux':
+                collector_class = ProcSystemInfoCollector  # 直接读取 /proc 的采集后端
+            else:
+                self.logger.warning("The proc collector backend is only available on Linux, falling back to psutil")
+        self.collector = collector_class(
+            self.logger,
+            host_facts_interval=self.config.get('host_facts_interval', 300),
+            max_workers=self.config.get('collector_workers', 4),
+            top_processes=self.config.get('top_processes', 5),
+            stats=self.stats
+        )
+        self.host_facts_version = 0  # 已交给上传器的主机信息版本
+        # 各指标族的采集周期（秒），未配置的指标族使用 collect_interval
+        schedules = self.config.get('schedules', {})
+        self.schedules = {
+            family: schedules.get(family, self.config['collect_interval']) for family in METRIC_FAMILIES
+        }
         self.logger.info("Init WebSocketUploader")
-        self.ws_client = WebSocketUploader(self.config['server_url'], self.config['secret'], self.logger)
+        encoder = None
+        if self.config.get('delta_encoding', False):
+            encoder = DeltaEncoder(self.config.get('keyframe_interval', 20))
+        compressor = None
+        compression = self.config.get('compression', {})
+        if compression.get('enabled', False):
+            compressor = FrameCompressor(
+                self.logger,
+                level=compression.get('level', 6),
+                dictionary=compression.get('dictionary', 'static')
+            )
+        self.ws_client = WebSocketUploader(
+            self.config['server_url'], self.config['secret'], self.logger,
+            window=self.config.get('inflight_window', 8),
+            ack_timeout=self.config.get('ack_timeout', 30),
+            encoder=encoder,
+            wire_format=self.config.get('wire_format', 'json'),
+            compressor=compressor,
+            stats=self.stats,
+            backoff_initial=self.config.get('reconnect', {}).get('initial_delay', 1),
+            backoff_max=self.config.get('reconnect', {}).get('max_delay', 60)
+        )
 
     async def collect_info(self):
+        """按各指标族的周期采集，合并为一个样本流"""
+        loop = asyncio.get_running_loop()
+        next_due = {family: loop.time() for family in self.schedules}  # 各指标族下次采集的时间
+        next_stats = loop.time() + self.stats_interval  # 下次报告运行统计的时间
         while True:
+            now = loop.time()
+            due = [family for family, due_time in next_due.items() if due_time <= now]
+            for family in due:
+                # 采集耗时超过周期时跳过错过的轮次，不连续补采
+                while next_due[family] <= now:
+                    next_due[family] += self.schedules[family]
             self.logger.info("Collent sys info")
-            self.collector.update_full_system_info()
-            system_info = self.collector.get_full_system_info()
+            await self.collector.collect(due)  # 在线程池中采集，不阻塞上传和心跳
+            if self.collector.host_facts_version != self.host_facts_version:
+                # 主机信息按会话发送，不随每个样本上传
+                self.host_facts_version = self.collector.host_facts_version
+                self.ws_client.set_host_facts(self.collector.get_host_facts())
+            system_info = self.collector.get_system_sample()
+            if self.stats and loop.time() >= next_stats:
+                next_stats += self.stats_interval
+                agent_stats = await self.report_stats()
+                if self.stats_upload:
+                    system_info = {**system_info, "agent_stats": agent_stats}
             self.logger.info("Push sys info")
-            await self.message_queue.put(system_info)
-            await asyncio.sleep(self.config['collect_interval'])
+            self.sample_buffer.push(system_info)  # 不阻塞，缓冲区满时丢弃最旧样本
+            await asyncio.sleep(max(0, min(next_due.values()) - loop.time()))
+
+    async def spool_call(self, func, *args):
+        """在磁盘缓冲区的线程中执行 func，所有读写依次执行，不会并发修改段文件"""
+        return await asyncio.get_running_loop().run_in_executor(self.spool_executor, func, *args)
+
+    async def report_stats(self):
+        """生成一个周期的运行统计，写入本地文件并返回"""
+        self.stats.gauge("buffer.depth", len(self.sample_buffer))
+        self.stats.gauge("buffer.dropped", self.sample_buffer.dropped)
+        self.stats.gauge("upload.in_flight", len(self.ws_client.pending))
+        if self.spool:
+            self.stats.gauge("spool.pending_bytes", await self.spool_call(self.spool.pending_bytes))
+            self.stats.gauge("spool.evicted", self.spool.evicted)
+        if self.ws_client.compressor:
+            self.stats.gauge("upload.compression_ratio", round(self.ws_client.compressor.ratio(), 2))
+        self.stats.gauge("process.rss", psutil.Process().memory_info().rss)
+        self.stats.gauge("log.dropped", self.logger.dropped())
+        agent_stats = self.stats.snapshot()
+        self.logger.info(f"Agent stats: cpu {agent_stats['cpu_percent']}%, {agent_stats['counters']}")
+        if self.stats_file:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, AgentStats.dump, agent_stats, self.stats_file)
+            except OSError as e:
+                self.logger.error(f"Failed to write agent stats: {e}")
+        return agent_stats
+
+    async def fast_sample_info(self):
+        """高频采样 CPU、内存和网卡速率，在下一个样本中上报窗口汇总"""
+        interval = self.config.get('fast_sample_interval', 0)
+        if not interval:
+            return
+        loop = asyncio.get_running_loop()
+        sample_fast = self.collector.sample_fast
+        if self.stats:
+            sample_fast = self.stats.timed("collector.sample_fast", sample_fast)
+        while True:
+            await loop.run_in_executor(self.collector.executor, sample_fast)
+            await asyncio.sleep(interval)
 
     async def upload_info(self):
-        """从队列中取出数据并发送"""
+        """从缓冲区中按批取出数据并发送"""
+        while True:
+            # 样本数量达到批次上限或最旧样本超时后发送
+            await self.sample_buffer.wait_for_batch(self.batch_max_size, self.batch_max_age)
+            batch = self.sample_buffer.pop_batch(self.batch_max_size)
+            self.logger.info("Sent %d sys info samples", len(batch))
+            if not await self.ws_client.send_batch(batch):
+                if self.spool:
+                    # 发送失败，写入磁盘缓冲区，由 drain_spool 在连接恢复后补发
+                    await self.spool_call(self.spool.append, batch)
+                    if self.stats:
+                        self.stats.incr("spool.appended", len(batch))
+                else:
+                    # 发送失败，放回缓冲区，等到重连退避结束后重试
+                    self.sample_buffer.requeue(batch)
+                await asyncio.sleep(self.ws_client.retry_delay() or self.config['upload_interval'])
+
+    async def drain_spool(self):
+        """连接恢复后从磁盘缓冲区中按批补发样本，限制补发速率以免挤占实时上传"""
+        if not self.spool:
+            return
+        loop = asyncio.get_running_loop()
         while True:
-            self.logger.info("Pop sys info")
-            data = await self.message_queue.get()
-            self.logger.info("Sent sys info")
-            await self.ws_client.send_data(data)
-            await asyncio.sleep(self.config['upload_interval'])
+            if not self.ws_client.websocket or not await self.spool_call(self.spool.pending):
+                await asyncio.sleep(self.config['upload_interval'])
+                continue
+            samples, cursor = await self.spool_call(self.spool.read_batch, self.spool_batch_size)
+            if not samples:
+                await self.spool_call(self.spool.commit, cursor)
+                continue
+            acked = loop.create_future()
+            if await self.ws_client.send_batch(samples, on_ack=lambda: acked.done() or acked.set_result(None)):
+                # 进入发送窗口不代表服务端已收到，等到该消息被确认后才移动读取位置，
+                # 期间断线时由上传器重传，Agent 退出时这些样本仍保留在磁盘上
+                await acked
+                await self.spool_call(self.spool.commit, cursor)
+                pending_bytes = await self.spool_call(self.spool.pending_bytes)
+                self.logger.info(f"Drained {len(samples)} spooled samples, {pending_bytes} bytes left")
+                if self.stats:
+                    self.stats.incr("spool.drained", len(samples))
+                await asyncio.sleep(len(samples) / self.spool_drain_rate)
+            else:
+                await asyncio.sleep(self.ws_client.retry_delay() or self.config['upload_interval'])
 
     async def run(self):
-        """运行所有任务"""
+        """运行所有任务，收到 SIGTERM 或被取消时关闭连接、采集器和磁盘缓冲区"""
         self.logger.info("Agent Start")
-        await asyncio.gather(
-            self.collect_info(),
-            self.upload_info()
-        )
+        try:
+            # 服务停止时发送 SIGTERM，取消所有任务后执行清理
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, AttributeError):
+            pass  # Windows 的事件循环不支持信号处理
+        try:
+            await asyncio.gather(
+                self.collect_info(),
+                self.fast_sample_info(),
+                self.upload_info(),
+                self.drain_spool()
+            )
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """关闭连接、采集器（线程池和缓存的文件描述符）和磁盘缓冲区"""
+        self.logger.info("Agent Stop")
+        await self.ws_client.close()
+        self.collector.close()
+        if self.spool:
+            self.spool_executor.shutdown(wait=True)
+            self.spool.close()
 
 LOG_CONFIG = {
     "name": "my_app",
@@ -54,13 +237,17 @@ LOG_CONFIG = {
         "maxBytes": 1024 * 1024 * 10,
         "backupCount": 5
     },
-    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s"
+    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s",
+    "async_logging": True  # 日志在后台线程中写入，不阻塞事件循环
 }
 
 def main():
     logger = Logger(**LOG_CONFIG)
     app = MainApp('config.json', logger)
-    asyncio.run(app.run())
+    try:
+        asyncio.run(app.run())
+    except asyncio.CancelledError:
+        pass  # 收到 SIGTERM，清理完成后正常退出
 
 
 if __name__ == "__main__":
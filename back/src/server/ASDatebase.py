@@ -1,28 +1,71 @@
 import sqlite3
 import json
+import queue
 import threading
+from contextlib import contextmanager
 from Logger import Logger
 
+# SQLite 连接参数的默认值，server.py 中的 SQLITE_SETTINGS 可以覆盖
+DEFAULT_SQLITE_SETTINGS = {
+    "journal_mode": "WAL",  # 读写互不阻塞
+    "synchronous": "NORMAL",  # WAL 模式下只在检查点时同步，进程崩溃不丢数据
+    "mmap_size": 256 * 1024 * 1024,  # 内存映射读取的大小（字节）
+    "cache_size": -64 * 1024,  # 页缓存大小，负数表示 KiB
+    "busy_timeout": 5000  # 等待其他连接释放锁的最长时间（毫秒）
+}
+
+# performance_data 中的数值列：列名 -> 从 JSON 列回填旧数据的表达式
+METRIC_COLUMNS = {
+    "cpu_percent": "json_extract(cpu_info, '$.percent_usage')",
+    "memory_percent": "json_extract(memory_info, '$.percent')",
+    "disk_max_percent": "(SELECT MAX(json_extract(value, '$.percent')) FROM json_each(disk_info))",
+    "net_upload_speed": "(SELECT SUM(json_extract(value, '$.io_stats.upload_speed')) FROM json_each(network_info))",
+    "net_download_speed": "(SELECT SUM(json_extract(value, '$.io_stats.download_speed')) FROM json_each(network_info))"
+}
+
+def metric_values(cpu_info: dict, memory_info: dict, disk_info: list, network_info: dict) -> tuple:
+    """
+    从样本中提取 METRIC_COLUMNS 对应的数值，缺失的指标为 None。
+
+    :return: (CPU 使用率, 内存使用率, 最大磁盘使用率, 网卡总上传速度, 网卡总下载速度)
+    """
+    disk_percents = [disk["percent"] for disk in disk_info or [] if disk.get("percent") is not None]
+    io_stats = [iface.get("io_stats") or {} for iface in (network_info or {}).values()]
+    return (
+        (cpu_info or {}).get("percent_usage"),
+        (memory_info or {}).get("percent"),
+        max(disk_percents) if disk_percents else None,
+        sum(stats.get("upload_speed") or 0 for stats in io_stats) if io_stats else None,
+        sum(stats.get("download_speed") or 0 for stats in io_stats) if io_stats else None
+    )
+
 class ASDatabase:
-    def __init__(self, db_path: str, logger: Logger):
+    def __init__(self, db_path: str, logger: Logger, settings: dict = None):
         """
         初始化 Database 类。
 
         :param db_path: SQLite 数据库文件路径
         :param logger: 日志记录器
+        :param settings: SQLite 连接参数（PRAGMA 名称 -> 值），未指定的使用 DEFAULT_SQLITE_SETTINGS
         """
         self.db_path = db_path
         self.logger = logger
+        self.settings = {**DEFAULT_SQLITE_SETTINGS, **(settings or {})}
         self.conn = None
         self.cursor = None
         self.lock = threading.Lock()  # 线程锁
 
     def connect(self):
         """
-        连接到 SQLite 数据库。
+        连接到 SQLite 数据库并应用连接参数。
         """
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            # 连接由连接池在线程之间传递，同一时间只被一个线程使用，并由 self.lock 保护
+            self.conn = sqlite3.connect(
+                self.db_path, timeout=self.settings["busy_timeout"] / 1000, check_same_thread=False
+            )
+            for name, value in self.settings.items():
+                self.conn.execute(f"PRAGMA {name} = {value}")
             self.cursor = self.conn.cursor()
             self.logger.info("Connected to SQLite database")
         except sqlite3.Error as e:
@@ -55,6 +98,7 @@ class ASDatabase:
                         server_notes TEXT
                     )
                 """)
+                self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_servers_ip ON servers (ip_address)")
 
                 # 创建 performance_data 表
                 self.cursor.execute("""
@@ -68,15 +112,49 @@ class ASDatabase:
                         network_info TEXT,
                         boot_time DATETIME,
                         processes TEXT,
+                        disk_io_info TEXT,
+                        cpu_percent REAL,
+                        memory_percent REAL,
+                        disk_max_percent REAL,
+                        net_upload_speed REAL,
+                        net_download_speed REAL,
+                        agent_stats TEXT,
                         FOREIGN KEY (server_id) REFERENCES servers(id)
                     )
                 """)
 
+                self._migrate_performance_data()
+
+                # 按服务器和时间范围查询的索引，以及跨所有服务器按时间范围查询的索引
+                self.cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_performance_server_time ON performance_data (server_id, timestamp)
+                """)
+                self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_performance_time ON performance_data (timestamp)")
+
                 self.conn.commit()
                 self.logger.info("Created tables: servers and performance_data")
             except sqlite3.Error as e:
                 self.logger.error(f"Error creating tables: {e}")
 
+    def _migrate_performance_data(self):
+        """
+        为旧版数据库补充新增的列，并从 JSON 列回填数值列。
+        """
+        self.cursor.execute("PRAGMA table_info(performance_data)")
+        columns = {row[1] for row in self.cursor.fetchall()}
+        if "disk_io_info" not in columns:
+            self.cursor.execute("ALTER TABLE performance_data ADD COLUMN disk_io_info TEXT")
+        if "agent_stats" not in columns:
+            self.cursor.execute("ALTER TABLE performance_data ADD COLUMN agent_stats TEXT")
+        added = [column for column in METRIC_COLUMNS if column not in columns]
+        for column in added:
+            self.cursor.execute(f"ALTER TABLE performance_data ADD COLUMN {column} REAL")
+        if added:
+            self.cursor.execute(
+                f"UPDATE performance_data SET {', '.join(f'{column} = {METRIC_COLUMNS[column]}' for column in added)}"
+            )
+            self.logger.info(f"Migrated performance_data: added {', '.join(added)} ({self.cursor.rowcount} rows backfilled)")
+
     def insert_server(self, server_name: str, platform: str, version: str, ip_address: str, server_notes: str = None):
         """
         插入一条服务器记录。
@@ -102,7 +180,7 @@ class ASDatabase:
                 self.logger.error(f"Error inserting server record: {e}")
                 return None
 
-    def insert_performance_data(self, server_id: int, cpu_info: dict, memory_info: dict, disk_info: list, network_info: dict, boot_time: str, processes: list):
+    def insert_performance_data(self, server_id: int, cpu_info: dict, memory_info: dict, disk_info: list, network_info: dict, boot_time: str, processes: list, timestamp: str = None, disk_io_info: dict = None, agent_stats: dict = None):
         """
         插入一条性能数据记录。
 
@@ -113,18 +191,110 @@ class ASDatabase:
         :param network_info: 网络信息
         :param boot_time: 启动时间
         :param processes: 进程信息
+        :param timestamp: 采集时间（格式：'YYYY-MM-DD HH:MM:SS'，None 表示使用当前时间）
+        :param disk_io_info: 磁盘 I/O 信息（旧版 Agent 不提供）
+        :param agent_stats: Agent 自身的运行统计（只有开启上传的 Agent 每个统计周期附带一次）
         """
         with self.lock:  # 加锁
             try:
-                self.cursor.execute("""
-                    INSERT INTO performance_data (server_id, timestamp, cpu_info, memory_info, disk_info, network_info, boot_time, processes)
-                    VALUES (?, datetime('now'), ?, ?, ?, ?, ?, ?)
-                """, (server_id, json.dumps(cpu_info), json.dumps(memory_info), json.dumps(disk_info), json.dumps(network_info), boot_time, json.dumps(processes)))
+                self.cursor.execute(f"""
+                    INSERT INTO performance_data (server_id, timestamp, cpu_info, memory_info, disk_info, network_info, boot_time, processes, disk_io_info, agent_stats,
+                                                  {', '.join(METRIC_COLUMNS)})
+                    VALUES (?, COALESCE(?, datetime('now')), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (server_id, timestamp, json.dumps(cpu_info), json.dumps(memory_info), json.dumps(disk_info), json.dumps(network_info), boot_time, json.dumps(processes),
+                      json.dumps(disk_io_info) if disk_io_info is not None else None,
+                      json.dumps(agent_stats) if agent_stats is not None else None,
+                      *metric_values(cpu_info, memory_info, disk_info, network_info)))
                 self.conn.commit()
-                self.logger.info(f"Inserted performance data for server ID: {server_id}")
+                self.logger.debug("Inserted performance data for server ID: %s", server_id)
             except sqlite3.Error as e:
                 self.logger.error(f"Error inserting performance data: {e}")
 
+    def load_server_ids(self) -> dict:
+        """
+        返回全部服务器的 IP 地址 -> 服务器 ID，用于在内存中维护服务器登记表。
+
+        同一 IP 地址有多条记录时取最早的一条。
+        """
+        with self.lock:  # 加锁
+            try:
+                self.cursor.execute("SELECT ip_address, MIN(id) FROM servers GROUP BY ip_address")
+                return dict(self.cursor.fetchall())
+            except sqlite3.Error as e:
+                self.logger.error(f"Error loading server ids: {e}")
+                return {}
+
+    def write_batch(self, records: list, server_ids: dict):
+        """
+        在一个事务中写入一批样本：为登记表中没有的服务器创建记录，批量插入性能数据，只提交一次。
+
+        服务器的状态和最后心跳时间不在这里更新，由调用方定期通过 update_last_seen 批量写入。
+
+        :param records: 样本列表，每个元素为 (ip_address, server_info, performance_data)：
+                        server_info 包含 platform、version、server_notes，用于创建新服务器；
+                        performance_data 包含 insert_performance_data 的各个参数（server_id 除外）
+        :param server_ids: 已知服务器的登记表：IP 地址 -> 服务器 ID，不会被修改
+        :return: 本批新创建的服务器：IP 地址 -> 服务器 ID，写入失败时返回 None
+        """
+        with self.lock:  # 加锁
+            try:
+                new_servers = {}
+                for ip_address, server_info, _ in records:
+                    if ip_address in server_ids or ip_address in new_servers:
+                        continue
+                    self.cursor.execute("""
+                        INSERT INTO servers (server_name, platform, version, ip_address, last_seen, server_notes)
+                        VALUES (?, ?, ?, ?, datetime('now'), ?)
+                    """, (f"Server-{ip_address}", server_info["platform"], server_info["version"], ip_address,
+                          server_info.get("server_notes")))  # 默认服务器名称为 "Server-IP"
+                    new_servers[ip_address] = self.cursor.lastrowid
+                    self.logger.info(f"Inserted server record: Server-{ip_address} (ID: {self.cursor.lastrowid})")
+
+                self.cursor.executemany(f"""
+                    INSERT INTO performance_data (server_id, timestamp, cpu_info, memory_info, disk_info, network_info, boot_time, processes, disk_io_info, agent_stats,
+                                                  {', '.join(METRIC_COLUMNS)})
+                    VALUES (?, COALESCE(?, datetime('now')), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (server_ids.get(ip_address) or new_servers[ip_address], data.get("timestamp"), json.dumps(data["cpu_info"]),
+                     json.dumps(data["memory_info"]), json.dumps(data["disk_info"]), json.dumps(data["network_info"]),
+                     data["boot_time"], json.dumps(data["processes"]),
+                     json.dumps(data["disk_io_info"]) if data.get("disk_io_info") is not None else None,
+                     json.dumps(data["agent_stats"]) if data.get("agent_stats") is not None else None,
+                     *metric_values(data["cpu_info"], data["memory_info"], data["disk_info"], data["network_info"]))
+                    for ip_address, _, data in records
+                ])
+                self.conn.commit()
+                self.logger.debug("Inserted %d performance records", len(records))
+                return new_servers
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                # TypeError/ValueError 来自无法序列化的样本字段
+                self.conn.rollback()
+                self.logger.error(f"Error writing batch of {len(records)} records: {e}")
+                return None
+            except Exception:
+                self.conn.rollback()  # 不留下写了一半的事务，由调用方处理异常
+                raise
+
+    def update_last_seen(self, last_seen: dict) -> bool:
+        """
+        在一个事务中批量更新服务器的状态和最后心跳时间。
+
+        :param last_seen: 服务器 ID -> 最后心跳时间（格式：'YYYY-MM-DD HH:MM:SS'，UTC）
+        :return: 是否更新成功
+        """
+        with self.lock:  # 加锁
+            try:
+                self.cursor.executemany("""
+                    UPDATE servers SET status = 'online', last_seen = ? WHERE id = ?
+                """, [(timestamp, server_id) for server_id, timestamp in last_seen.items()])
+                self.conn.commit()
+                self.logger.debug("Updated last_seen of %d servers", len(last_seen))
+                return True
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                self.logger.error(f"Error updating last_seen of {len(last_seen)} servers: {e}")
+                return False
+
     def update_server_status(self, server_id: int, status: str):
         """
         更新服务器状态。
@@ -138,7 +308,7 @@ class ASDatabase:
                     UPDATE servers SET status = ?, last_seen = datetime('now') WHERE id = ?
                 """, (status, server_id))
                 self.conn.commit()
-                self.logger.info(f"Updated server status: {status} (ID: {server_id})")
+                self.logger.debug("Updated server status: %s (ID: %s)", status, server_id)
             except sqlite3.Error as e:
                 self.logger.error(f"Error updating server status: {e}")
 
@@ -154,32 +324,132 @@ class ASDatabase:
                 servers = self.cursor.fetchall()
                 # 将每条记录转换为字典
                 servers_dict = [dict(zip(columns, row)) for row in servers]
-                self.logger.info("Fetched server records")
+                self.logger.debug("Fetched server records")
                 return servers_dict
             except sqlite3.Error as e:
                 self.logger.error(f"Error fetching server records: {e}")
                 return []
 
-    def get_performance_data(self, server_id: int, start_time: str, end_time: str):
+    def iter_performance_data(self, start_time: str, end_time: str, server_ids: list = None, chunk_size: int = 500):
         """
-        返回指定时间戳范围内的性能记录信息，每条记录以字典形式返回。
-        :param server_id: 服务器 ID
+        用一次查询按时间范围读取所有（或指定）服务器的性能记录，每次返回一块，用于流式响应。
+
         :param start_time: 开始时间（格式：'YYYY-MM-DD HH:MM:SS'）
         :param end_time: 结束时间（格式：'YYYY-MM-DD HH:MM:SS'）
-        :return: 性能数据列表，每个元素是一个字典
+        :param server_ids: 只返回这些服务器的记录，None 表示所有服务器
+        :param chunk_size: 每块的记录数
+        :return: 生成器，每次返回最多 chunk_size 条记录（字典）的列表
         """
-        with self.lock:  # 加锁
+        query = "SELECT * FROM performance_data WHERE timestamp BETWEEN ? AND ?"
+        params = [start_time, end_time]
+        if server_ids is not None:
+            query += f" AND server_id IN ({', '.join('?' * len(server_ids))})"
+            params.extend(server_ids)
+        return self._iter_query(query, params, chunk_size, f"between {start_time} and {end_time}")
+
+    def iter_performance_after(self, after: int, limit: int, server_ids: list = None, chunk_size: int = 500):
+        """
+        按 ID 顺序读取 ID 大于 after 的性能记录，用于增量同步。
+
+        性能记录只由写入线程按顺序提交，ID 单调递增，已读到的最大 ID 即为同步位置，不会遗漏或重复。
+
+        :param after: 同步位置，只返回 ID 大于该值的记录
+        :param limit: 最多返回的记录数
+        :param server_ids: 只返回这些服务器的记录，None 表示所有服务器
+        :param chunk_size: 每块的记录数
+        :return: 生成器，每次返回最多 chunk_size 条记录（字典）的列表
+        """
+        query = "SELECT * FROM performance_data WHERE id > ?"
+        params = [after]
+        if server_ids is not None:
+            query += f" AND server_id IN ({', '.join('?' * len(server_ids))})"
+            params.extend(server_ids)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        return self._iter_query(query, params, chunk_size, f"after ID {after}")
+
+    def _iter_query(self, query: str, params: list, chunk_size: int, description: str):
+        """
+        执行性能记录查询，分块返回结果。
+
+        只在读取每一块时加锁，不会在整个响应期间占用连接的锁。
+        """
+        cursor = self.conn.cursor()  # 独立的游标，不影响其他查询
+        try:
+            with self.lock:  # 加锁
+                cursor.execute(query, params)
+                columns = [column[0] for column in cursor.description]  # 获取字段名
+            total = 0
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                total += len(rows)
+                yield [dict(zip(columns, row)) for row in rows]
+            self.logger.info(f"Fetched {total} performance records {description}")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error fetching performance data: {e}")
+        finally:
+            cursor.close()
+
+class ASDatabasePool:
+    def __init__(self, db_path: str, logger: Logger, size: int = 8, settings: dict = None, timeout: float = 30):
+        """
+        初始化有界的数据库连接池，供 Flask 的请求线程复用连接。
+
+        连接在首次需要时创建，最多 size 个；连接都被占用时等待其他请求归还。
+
+        :param db_path: SQLite 数据库文件路径
+        :param logger: 日志记录器
+        :param size: 最多创建的连接数
+        :param settings: SQLite 连接参数，与写入连接使用同一份配置
+        :param timeout: 等待空闲连接的最长时间（秒）
+        """
+        self.db_path = db_path
+        self.logger = logger
+        self.size = size
+        self.settings = settings
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()  # 空闲连接，后进先出以便复用缓存较热的连接
+        self.created = 0  # 已创建的连接数
+        self.lock = threading.Lock()
+
+    def _acquire(self) -> ASDatabase:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                db = ASDatabase(db_path=self.db_path, logger=self.logger, settings=self.settings)
+                db.connect()
+                return db
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available within {self.timeout}s")
+
+    @contextmanager
+    def connection(self):
+        """
+        借出一个连接，使用完毕后自动归还。
+
+        :return: ASDatabase 实例
+        """
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            self.idle.put(db)
+
+    def close(self):
+        """
+        关闭所有空闲连接。
+        """
+        while True:
             try:
-                self.cursor.execute("""
-                    SELECT * FROM performance_data
-                    WHERE server_id = ? AND timestamp BETWEEN ? AND ?
-                """, (server_id, start_time, end_time))
-                columns = [column[0] for column in self.cursor.description]  # 获取字段名
-                performance_data = self.cursor.fetchall()
-                # 将每条记录转换为字典
-                performance_data_dict = [dict(zip(columns, row)) for row in performance_data]
-                self.logger.info(f"Fetched performance data for server ID: {server_id} between {start_time} and {end_time}")
-                return performance_data_dict
-            except sqlite3.Error as e:
-                self.logger.error(f"Error fetching performance data: {e}")
-                return []
\ No newline at end of file
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,33 @@
+import threading
+
+class ChangeNotifier:
+    def __init__(self):
+        """
+        初始化数据变更通知：写入线程提交数据后通知，推送连接的请求线程等待通知后查询新数据。
+
+        只记录变更的版本号，不保存数据本身，等待方自己按同步位置查询。
+        """
+        self.condition = threading.Condition()
+        self.version = 0  # 每次提交后加 1
+
+    def notify(self):
+        """
+        通知所有等待方有新数据提交。
+        """
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """
+        等待版本号与 version 不同（有新提交）或超时。
+
+        应在查询之前读取版本号，查询期间的提交会让下一次等待立即返回，不会遗漏。
+
+        :param version: 调用方已经处理过的版本号
+        :param timeout: 最长等待时间（秒）
+        :return: 当前的版本号
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
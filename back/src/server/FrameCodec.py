@@ -0,0 +1,43 @@
+import json
+from typing import Any, List
+
+try:
+    import msgpack
+except ImportError:  # msgpack 为可选依赖，未安装时只能使用 JSON
+    msgpack = None
+
+class JsonCodec:
+    """JSON 文本帧编码（默认及回退编码）"""
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def decode(self, message) -> Any:
+        return json.loads(message)
+
+class MsgpackCodec:
+    """msgpack 二进制帧编码"""
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, message) -> Any:
+        return msgpack.unpackb(message, raw=False)
+
+CODECS = {JsonCodec.name: JsonCodec}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+
+def negotiate_codec(offered: List[str]):
+    """
+    从客户端提供的编码列表中选择第一个本端支持的编码，都不支持时回退到 JSON。
+
+    :param offered: 客户端按优先级排序的编码名称列表
+    :return: 编码器实例
+    """
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]()
+    return JsonCodec()
@@ -0,0 +1,51 @@
+import base64
+import zlib
+
+class FrameDecompressor:
+    def __init__(self, dictionary: bytes):
+        """
+        初始化逐消息解压器，每个 Agent 连接一个实例。
+
+        :param dictionary: Agent 在认证时发送的共享字典
+        """
+        self.dictionary = dictionary
+        self.raw_bytes = 0  # 解压后的累计字节数
+        self.compressed_bytes = 0  # 解压前的累计字节数
+
+    @classmethod
+    def from_handshake(cls, params: dict):
+        """
+        根据认证消息中的压缩参数创建解压器，不支持的压缩方式返回 None。
+
+        :param params: 认证消息中的 compression 字段
+        """
+        if not isinstance(params, dict) or params.get("method") != "deflate":
+            return None
+        return cls(base64.b64decode(params.get("dictionary") or ""))
+
+    def decompress(self, message) -> bytes:
+        """
+        解压一条消息。
+
+        :param message: 压缩后的消息
+        :return: 解压后的消息
+        :raises ValueError: 消息不是有效的压缩数据
+        """
+        if isinstance(message, str):
+            raise ValueError("Expected a compressed binary frame")
+        try:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.dictionary)
+            payload = decompressor.decompress(message) + decompressor.flush()
+        except zlib.error as e:
+            raise ValueError(f"Invalid compressed frame: {e}")
+        self.compressed_bytes += len(message)
+        self.raw_bytes += len(payload)
+        return payload
+
+    def ratio(self) -> float:
+        """
+        返回累计压缩率（解压后字节数 / 解压前字节数）。
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return self.raw_bytes / self.compressed_bytes
@@ -0,0 +1,46 @@
+def merge_host_facts(sample: dict, host_facts: dict) -> dict:
+    """
+    将会话中的主机信息合并到不含主机信息的样本中，还原为完整的系统信息记录。
+
+    已经包含主机信息的完整样本（旧版 Agent）原样返回。
+
+    :param sample: Agent 上传的样本
+    :param host_facts: Agent 在会话中发送的主机信息
+    :return: 完整的系统信息记录
+    """
+    if not host_facts or "platform" in sample:
+        return sample
+    devices = {part["mountpoint"]: part["device"] for part in host_facts["partitions"]}
+    network = sample.get("network", {})
+    return {
+        **sample,
+        "platform": host_facts["platform"],
+        "version": host_facts["version"],
+        "cpu": {
+            "physical_cores": host_facts["physical_cores"],
+            "logical_cores": host_facts["logical_cores"],
+            **sample.get("cpu", {})
+        },
+        "disk": [{"device": devices.get(disk["mountpoint"]), **disk} for disk in sample.get("disk", [])],
+        "network": {
+            interface: {
+                "addresses": addresses,
+                "io_stats": network.get(interface, {}).get("io_stats", {})
+            }
+            for interface, addresses in host_facts["interfaces"].items()
+        },
+        "boot_time": host_facts["boot_time"]
+    }
+
+def get_ip_address(network_info: dict) -> str:
+    """
+    从网络信息中提取 IP 地址，作为服务器的标识。
+
+    :param network_info: 网络信息字典
+    :return: 第一个非回环地址，没有时返回 "0.0.0.0"
+    """
+    for interface, info in network_info.items():
+        for addr in info.get("addresses", []):  # 遍历每个网卡的 addresses 列表
+            if addr.get("ip") and addr["ip"] != "127.0.0.1":  # 忽略本地回环地址
+                return addr["ip"]
+    return "0.0.0.0"  # 如果没有找到 IP 地址，返回默认值
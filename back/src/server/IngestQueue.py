@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from collections import deque
+from Logger import Logger
+
+POLICIES = ("delay_ack", "coalesce", "drop_oldest")
+LOG_INTERVAL = 10  # 过载日志的最短输出间隔（秒）
+
+class IngestQueue:
+    def __init__(self, maxsize: int, logger: Logger, policy: str = "delay_ack"):
+        """
+        初始化有界的样本队列，WebSocketReceive 放入样本，SystemInfoHandler 取出写入数据库。
+
+        队列已满时的处理方式：
+        - "delay_ack"：等待队列有空位，期间不再读取该连接的消息也不发送确认，Agent 的发送窗口填满后自动减速；
+        - "coalesce"：队列中已有同一 Agent 的样本时用新样本替换其中最新的一个（每个 Agent 只保留最新的状态），
+          没有时按 "delay_ack" 处理；
+        - "drop_oldest"：丢弃队列中最旧的样本。
+
+        :param maxsize: 队列中最多保存的样本数
+        :param logger: 日志记录器
+        :param policy: 队列已满时的处理方式
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ingest queue policy: {policy}")
+        self.maxsize = maxsize
+        self.logger = logger
+        self.policy = policy
+        self.items = deque()  # [来源, 样本]
+        self.latest = {}  # 来源 -> 队列中该来源最新的一项
+        self.condition = asyncio.Condition()
+        self.waiting = 0  # 等待空位的 put 数
+        self._notify_task = None  # 尚未执行的唤醒任务，同一时间最多一个
+        # 各种处理结果的计数
+        self.counters = {"accepted": 0, "delayed": 0, "coalesced": 0, "dropped": 0}
+
+    def qsize(self) -> int:
+        return len(self.items)
+
+    def empty(self) -> bool:
+        return not self.items
+
+    def _append(self, source, sample):
+        entry = [source, sample]
+        self.items.append(entry)
+        if source is not None:
+            self.latest[source] = entry
+        self.counters["accepted"] += 1
+        self.condition.notify_all()
+
+    def _popleft(self, notify: bool = True):
+        source, sample = entry = self.items.popleft()
+        if source is not None and self.latest.get(source) is entry:
+            del self.latest[source]
+        if notify:
+            self.condition.notify_all()
+        return sample
+
+    async def put(self, sample: dict, source=None):
+        """
+        放入一个样本，队列已满时按 policy 处理。
+
+        :param sample: 系统信息样本
+        :param source: 样本来源（Agent 的标识），用于 "coalesce"
+        """
+        async with self.condition:
+            if len(self.items) < self.maxsize:
+                self._append(source, sample)
+                return
+            if self.policy == "drop_oldest":
+                self._popleft()
+                self.counters["dropped"] += 1
+                self.logger.log_every(LOG_INTERVAL, logging.WARNING, "Ingest queue full, dropped oldest samples (%d total)",
+                                      self.counters["dropped"])
+                self._append(source, sample)
+                return
+            if self.policy == "coalesce" and source in self.latest:
+                self.latest[source][1] = sample
+                self.counters["coalesced"] += 1
+                self.logger.log_every(LOG_INTERVAL, logging.WARNING, "Ingest queue full, coalesced samples (%d total)",
+                                      self.counters["coalesced"])
+                return
+            self.counters["delayed"] += 1
+            self.logger.log_every(LOG_INTERVAL, logging.WARNING, "Ingest queue full, delaying acks (%d samples delayed)",
+                                  self.counters["delayed"])
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: len(self.items) < self.maxsize)
+            finally:
+                self.waiting -= 1
+            self._append(source, sample)
+
+    async def get(self) -> dict:
+        """
+        取出最旧的样本，队列为空时等待。
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.items)
+            return self._popleft()
+
+    def get_nowait(self) -> dict:
+        """
+        取出最旧的样本，队列为空时抛出 asyncio.QueueEmpty。
+        """
+        if not self.items:
+            raise asyncio.QueueEmpty()
+        sample = self._popleft(notify=False)
+        if self.waiting and (self._notify_task is None or self._notify_task.done()):
+            # 唤醒等待空位的 put，notify 需要持有锁，交给事件循环执行；
+            # 已有唤醒任务未执行时不再创建，它执行时会按当时的空位唤醒
+            self._notify_task = asyncio.get_running_loop().create_task(self._notify())
+        return sample
+
+    async def _notify(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        返回队列的当前深度和各种处理结果的计数。
+        """
+        return {"size": len(self.items), "maxsize": self.maxsize, "policy": self.policy, **self.counters}
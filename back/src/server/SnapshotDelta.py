@@ -0,0 +1,72 @@
+from typing import Any
+
+def apply_delta(base: Any, ops: list) -> Any:
+    """
+    将字段级差异应用到基准快照上，得到新的完整快照。
+
+    基准快照不会被修改：只复制差异路径上经过的容器，其余部分与基准快照共享。
+
+    :param base: 基准快照
+    :param ops: 差异操作列表，[路径, 新值] 表示设置字段，[路径] 表示删除字段
+    :return: 新的完整快照
+    """
+    copied = set()  # 已复制过的容器
+
+    def _copy(container):
+        container = container.copy()
+        copied.add(id(container))
+        return container
+
+    result = base
+    for op in ops:
+        path = op[0]
+        if not path:
+            result = op[1]
+            continue
+        if id(result) not in copied:
+            result = _copy(result)
+        node = result
+        for key in path[:-1]:
+            child = node[key]
+            if id(child) not in copied:
+                child = _copy(child)
+                node[key] = child
+            node = child
+        if len(op) > 1:
+            node[path[-1]] = op[1]
+        else:
+            del node[path[-1]]
+    return result
+
+class DeltaDecoder:
+    def __init__(self, max_snapshots: int = 1024):
+        """
+        初始化快照差分解码器，每个 Agent 连接一个实例。
+
+        :param max_snapshots: 最多保留的历史快照数量
+        """
+        self.max_snapshots = max_snapshots
+        self.snapshots = {}  # 快照编号 -> 完整快照
+
+    def decode(self, entry: dict) -> dict:
+        """
+        还原一个关键帧或差分帧。
+
+        :param entry: 关键帧 {"sid", "key"} 或差分帧 {"sid", "base", "delta"}
+        :return: 完整的系统信息样本
+        :raises ValueError: 差分帧引用的基准快照不存在
+        """
+        if "key" in entry:
+            snapshot = entry["key"]
+        else:
+            base_sid = entry["base"]
+            if base_sid not in self.snapshots:
+                raise ValueError(f"Unknown base snapshot {base_sid}")
+            snapshot = apply_delta(self.snapshots[base_sid], entry["delta"])
+            # Agent 只会引用更新的已确认快照，更早的快照不再需要
+            for sid in [s for s in self.snapshots if s < base_sid]:
+                del self.snapshots[sid]
+        self.snapshots[entry["sid"]] = snapshot
+        while len(self.snapshots) > self.max_snapshots:
+            del self.snapshots[min(self.snapshots)]
+        return snapshot
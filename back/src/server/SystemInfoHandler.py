@@ -1,103 +1,197 @@
 import asyncio
 import json
+import logging
+import queue
+import threading
+import time
 from Logger import Logger
 from ASDatebase import ASDatabase  # 假设 Database 类在 Database.py 文件中
+from HostFacts import get_ip_address
+from ChangeNotifier import ChangeNotifier
+from IngestQueue import IngestQueue
+
+LOG_INTERVAL = 10  # 每个样本都会执行的日志的最短输出间隔（秒）
 
 class SystemInfoHandler:
-    def __init__(self, data_queue: asyncio.Queue, db_path: str, logger: Logger):
+    def __init__(self, data_queue: IngestQueue, db_path: str, logger: Logger, batch_size: int = 500, batch_delay: float = 0.05, write_queue_size: int = 64, db_settings: dict = None, last_seen_interval: float = 10, notifier: ChangeNotifier = None):
         """
         初始化 SystemInfoHandler。
 
-        :param data_queue: 用于接收系统信息数据的 asyncio.Queue
+        :param data_queue: 用于接收系统信息数据的 IngestQueue
         :param db_path: SQLite 数据库文件路径
         :param logger: 日志记录器
+        :param batch_size: 每个事务最多写入的样本数
+        :param batch_delay: 收到第一个样本后最多再等待多久凑齐一批（秒）
+        :param write_queue_size: 等待写入线程处理的批次数上限，写入跟不上时事件循环在此处等待
+        :param db_settings: SQLite 连接参数
+        :param last_seen_interval: 服务器状态和最后心跳时间的批量写入间隔（秒）
+        :param notifier: 数据提交后通知推送连接（可选）
         """
         self.data_queue = data_queue
         self.db_path = db_path
         self.logger = logger
-        self.db = ASDatabase(db_path=self.db_path, logger=self.logger)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.db = ASDatabase(db_path=self.db_path, logger=self.logger, settings=db_settings)
+        # 数据库写入在独立线程中进行，事件循环只负责网络 I/O 和解码
+        self.write_queue = queue.Queue(maxsize=write_queue_size)
+        self.writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        # 以下状态只在写入线程中访问
+        self.server_ids = {}  # 服务器登记表：IP 地址 -> 服务器 ID，启动时从数据库加载，出现新服务器时更新
+        self.last_seen = {}  # 尚未写入数据库的最后心跳时间：服务器 ID -> 时间
+        self.last_seen_interval = last_seen_interval
+        self.notifier = notifier
+        self._last_seen_flushed = time.monotonic()
+
+    async def _next_batch(self) -> list:
+        """
+        等待第一个样本，之后继续收集样本，直到达到 batch_size 个或等待超过 batch_delay 秒。
+        """
+        batch = [await self.data_queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_delay
+        while len(batch) < self.batch_size:
+            if not self.data_queue.empty():
+                batch.append(self.data_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.data_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
 
     async def process_data(self):
         """
-        从队列中获取数据并存储到数据库中。
+        从队列中批量获取数据，交给写入线程存储到数据库中。
         """
-        self.db.connect()  # 连接到数据库
-        self.db.create_tables() # 创建数据库表
+        self.writer.start()
+        loop = asyncio.get_running_loop()
         while True:
-            # 从队列中获取数据（阻塞操作）
-            data = await self.data_queue.get()
-            self.logger.debug(f"Processing data: {data}")
-
+            batch = await self._next_batch()
+            self.logger.debug("Processing %d samples", len(batch))
             try:
-                pass
-                # 插入或更新服务器记录
-                server_id = self._insert_or_update_server(data)
-
-                # 插入性能数据记录
-                self._insert_performance_data(server_id, data)
-            except Exception as e:
-                self.logger.error(f"Error processing data: {e}")
+                self.write_queue.put_nowait(batch)
+            except queue.Full:
+                # 写入线程跟不上时在线程池中等待空位，不阻塞事件循环
+                self.logger.log_every(LOG_INTERVAL, logging.WARNING, "Database writer is falling behind (%d batches queued)",
+                                      self.write_queue.qsize())
+                await loop.run_in_executor(None, self.write_queue.put, batch)
 
-    def _insert_or_update_server(self, data) -> int:
+    def _writer_loop(self):
         """
-        插入或更新服务器记录。
+        写入线程：连接数据库，依次写入批次，排队的批次合并到同一个事务中，每个事务只提交一次。
+        """
+        self.db.connect()  # 连接到数据库（SQLite 连接只能在创建它的线程中使用）
+        self.db.create_tables() # 创建数据库表
+        self.server_ids = self.db.load_server_ids()
+        self.logger.info(f"Loaded {len(self.server_ids)} servers into the registry")
+        while True:
+            try:
+                # 没有新数据时也按时写入最后心跳时间
+                batch = self.write_queue.get(timeout=self.last_seen_interval)
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.extend(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            # 写入线程退出后样本会一直积压，任何异常都只记录日志，丢弃这一批后继续运行
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    self.logger.exception(f"Unexpected error writing batch of {len(batch)} samples, batch dropped")
+            if self.last_seen and time.monotonic() - self._last_seen_flushed >= self.last_seen_interval:
+                try:
+                    self._flush_last_seen()
+                except Exception:
+                    self.logger.exception("Unexpected error flushing last_seen")
+                    self._last_seen_flushed = time.monotonic()
 
-        :param data: 系统信息数据
-        :return: 服务器 ID
+    def _flush_last_seen(self):
         """
-        # 从网络信息中提取 IP 地址
-        ip_address = self._get_ip_address(data["network"])
-        # 检查服务器是否已存在
-        self.db.cursor.execute("SELECT id FROM servers WHERE ip_address = ?", (ip_address,))
-        result = self.db.cursor.fetchone()
+        将累积的最后心跳时间在一个事务中写入数据库，失败时保留到下次重试。
+        """
+        if self.db.update_last_seen(self.last_seen):
+            self.last_seen = {}
+            if self.notifier:
+                self.notifier.notify()
+        self._last_seen_flushed = time.monotonic()
 
-        if result:
-            # 如果服务器已存在，更新状态和最后心跳时间
-            server_id = result[0]
-            self.db.update_server_status(server_id=server_id, status="online")
-            self.logger.info(f"Updated server status: {ip_address} (ID: {server_id})")
-        else:
-            # 如果服务器不存在，插入新记录
-            server_id = self.db.insert_server(
-                server_name=f"Server-{ip_address}",  # 默认服务器名称为 "Server-IP"
-                platform=data["platform"],
-                version=data["version"],
-                ip_address=ip_address,
-                server_notes=data.get("server_notes")
-            )
-            self.logger.info(f"Inserted new server: {ip_address} (ID: {server_id})")
+    def _write_batch(self, batch: list):
+        """
+        将一批系统信息数据写入数据库。
 
-        return server_id
+        :param batch: 系统信息数据列表
+        """
+        records = []
+        for data in batch:
+            try:
+                records.append(self._to_record(data))
+            except (KeyError, TypeError, AttributeError) as e:
+                self.logger.error(f"Error processing data: {e}")
+        if not records:
+            return
+        written = self._write_records(records)
+        if not written:
+            return
+        if self.notifier:
+            self.notifier.notify()
+        self.logger.log_every(LOG_INTERVAL, logging.INFO, "Inserted %d performance records (%d servers registered)",
+                              written, len(self.server_ids))
 
-    def _insert_performance_data(self, server_id: int, data):
+    def _write_records(self, records: list) -> int:
         """
-        插入性能数据记录。
+        在一个事务中写入记录；事务失败时将记录分成两半分别重试，
+        只丢弃无法写入的单条记录，不影响同一批中其他 Agent 的数据。
 
-        :param server_id: 服务器 ID
-        :param data: 系统信息数据
+        :param records: ASDatabase.write_batch 的记录列表
+        :return: 写入成功的记录数
         """
-        self.db.insert_performance_data(
-            server_id=server_id,
-            cpu_info=data["cpu"],
-            memory_info=data["memory"],
-            disk_info=data["disk"],
-            network_info=data["network"],
-            boot_time=data["boot_time"],
-            processes=data["processes"]
-        )
-        self.logger.info(f"Inserted performance data for server ID: {server_id}")
+        new_servers = self.db.write_batch(records, self.server_ids)
+        if new_servers is None:
+            if len(records) == 1:
+                self.logger.error(f"Dropped performance record from {records[0][0]} that could not be written")
+                return 0
+            middle = len(records) // 2
+            return self._write_records(records[:middle]) + self._write_records(records[middle:])
+        self.server_ids.update(new_servers)
+        # 只在内存中记录心跳时间（与 SQLite 的 datetime('now') 格式一致），由 _flush_last_seen 定期写入
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        for ip_address in {ip_address for ip_address, _, _ in records}:
+            self.last_seen[self.server_ids[ip_address]] = now
+        return len(records)
 
-    def _get_ip_address(self, network_info: dict) -> str:
+    def _to_record(self, data) -> tuple:
         """
-        从网络信息中提取 IP 地址。
-        :param network_info: 网络信息字典
-        :return: IP 地址
+        将系统信息数据转换为 ASDatabase.write_batch 的记录。
+
+        :param data: 系统信息数据
+        :return: (ip_address, server_info, performance_data)
         """
-        for interface, info in network_info.items():
-            for addr in info.get("addresses", []):  # 遍历每个网卡的 addresses 列表
-                if addr.get("ip") and addr["ip"] != "127.0.0.1":  # 忽略本地回环地址
-                    return addr["ip"]
-        return "0.0.0.0"  # 如果没有找到 IP 地址，返回默认值
+        # WebSocketReceive 为每个会话计算一次 IP 地址，其他来源的数据从网络信息中提取
+        ip_address = data.get("ip_address") or get_ip_address(data["network"])
+        server_info = {
+            "platform": data["platform"],
+            "version": data["version"],
+            "server_notes": data.get("server_notes")
+        }
+        performance_data = {
+            "cpu_info": data["cpu"],
+            "memory_info": data["memory"],
+            "disk_info": data["disk"],
+            "network_info": data["network"],
+            "boot_time": data["boot_time"],
+            "processes": data["processes"],
+            "timestamp": data.get("timestamp"),  # 批量上传的样本带有采集时间
+            "disk_io_info": data.get("disk_io"),
+            "agent_stats": data.get("agent_stats")  # 开启上传的 Agent 每个统计周期附带一次
+        }
+        return ip_address, server_info, performance_data
 
     def run(self):
         """
@@ -1,24 +1,150 @@
 import asyncio
 import websockets
 import json
+import secrets
+import time
 from Logger import Logger
+from SnapshotDelta import DeltaDecoder
+from FrameCodec import JsonCodec, negotiate_codec
+from FrameCompressor import FrameDecompressor
+from HostFacts import merge_host_facts, get_ip_address
+from IngestQueue import IngestQueue
 
 class WebSocketReceive:
-    def __init__(self, host: str, port: int, secret: str, data_queue: asyncio.Queue, logger: Logger):
+    def __init__(self, host: str, port: int, secret: str, data_queue: IngestQueue, logger: Logger, ack_every: int = 4, ack_delay: float = 0.2, session_ttl: float = 300):
         """
         初始化 WebSocket 服务器。
 
         :param host: WebSocket 服务器绑定的主机地址
         :param port: WebSocket 服务器绑定的端口
         :param secret: 用于验证客户端的密钥
-        :param data_queue: 用于存储接收到的数据的 asyncio.Queue
+        :param data_queue: 用于存储接收到的数据的有界队列，队列已满时放入样本可能需要等待，期间不发送确认
         :param logger: 日志记录器
+        :param ack_every: 每收到多少个带序列号的消息发送一次累计确认
+        :param ack_delay: 累计确认的最长延迟（秒）
+        :param session_ttl: 连接断开后会话保留的时间（秒），Agent 在此期间重连可以恢复会话。
+                            会话只保存在进程内存中，只覆盖网络断开；服务端重启后 Agent 需要重新完整认证
         """
         self.host = host
         self.port = port
         self.secret = secret
         self.data_queue = data_queue
         self.logger = logger
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.session_ttl = session_ttl
+        self.sessions = {}  # 会话令牌 -> 会话状态（只在内存中，重启后失效）
+
+    async def _flush_ack(self, websocket, ack_state: dict):
+        """
+        发送累计确认：确认序列号 n 表示 n 及之前的消息均已收到。
+
+        :param websocket: WebSocket 连接对象
+        :param ack_state: 连接的确认状态
+        """
+        if ack_state["timer"]:
+            ack_state["timer"].cancel()
+            ack_state["timer"] = None
+        if ack_state["received"] > ack_state["acked"]:
+            ack_state["acked"] = ack_state["received"]
+            try:
+                await websocket.send(ack_state["codec"].encode({"ack": ack_state["acked"]}))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _schedule_ack(self, websocket, ack_state: dict):
+        """
+        累积到 ack_every 个消息时立即确认，否则在 ack_delay 秒后确认。
+
+        :param websocket: WebSocket 连接对象
+        :param ack_state: 连接的确认状态
+        """
+        if ack_state["received"] - ack_state["acked"] >= self.ack_every:
+            await self._flush_ack(websocket, ack_state)
+        elif not ack_state["timer"]:
+            ack_state["timer"] = asyncio.get_running_loop().call_later(
+                self.ack_delay, lambda: asyncio.create_task(self._flush_ack(websocket, ack_state))
+            )
+
+    def _new_session(self, websocket, auth_data: dict) -> dict:
+        """
+        为认证成功的新版 Agent 创建会话，并清理已过期的会话。
+
+        会话保存确认进度、编码、解压器、差分解码器和主机信息，Agent 断线重连时凭令牌恢复，
+        不需要重新发送压缩字典和主机信息，也不会重复入库已收到但未确认的消息。
+
+        会话不持久化：确认进度包括仍在队列中尚未写入数据库的样本，差分解码器的基准快照也只在内存中，
+        重启后这些状态都已丢失，恢复会话反而会让 Agent 跳过这些样本。因此会话恢复只覆盖网络断开，
+        服务端重启后 Agent 收到 session_unknown，随机等待后重新完整认证。
+
+        :param websocket: WebSocket 连接对象
+        :param auth_data: 认证消息
+        :return: 会话状态
+        """
+        now = time.monotonic()
+        for token in [t for t, s in self.sessions.items() if s["expires"] is not None and s["expires"] <= now]:
+            del self.sessions[token]
+        session = {
+            "token": secrets.token_urlsafe(16),
+            "received": 0,  # 已收到的最大序列号
+            "acked": 0,  # 已确认的最大序列号
+            "timer": None,  # 延迟确认的定时器
+            "codec": negotiate_codec(auth_data["encodings"]),
+            "decompressor": FrameDecompressor.from_handshake(auth_data.get("compression")),
+            "decoder": DeltaDecoder(),  # 还原差分编码的快照
+            "host_facts": auth_data.get("host_facts"),  # 会话中的主机信息，样本中不再重复携带
+            "ip_address": None,  # 由主机信息确定的服务器 IP 地址，收到第一个样本时计算
+            "websocket": websocket,  # 当前使用该会话的连接
+            "lock": asyncio.Lock(),  # 处理一条消息期间持有，恢复会话时等待正在入队的消息
+            "expires": None  # 连接断开后会话的过期时间
+        }
+        self.sessions[session["token"]] = session
+        return session
+
+    async def _resume_session(self, websocket, token: str):
+        """
+        恢复未过期的会话，仍被旧连接占用的会话转移到新连接并关闭旧连接。
+
+        旧连接可能正在等待队列空位，等它处理完当前消息后再读取确认进度，
+        否则恢复时返回的确认序列号偏旧，Agent 重传后同一条消息会再次入队。
+
+        :param websocket: WebSocket 连接对象
+        :param token: 会话令牌
+        :return: 会话状态，会话不存在或已过期时返回 None
+        """
+        session = self.sessions.get(token)
+        if not session:
+            return None
+        if session["expires"] is not None and session["expires"] <= time.monotonic():
+            del self.sessions[token]
+            return None
+        previous = session["websocket"]
+        session["websocket"] = websocket  # 旧连接不再处理新的消息
+        session["expires"] = None
+        async with session["lock"]:
+            if session["timer"]:
+                session["timer"].cancel()
+                session["timer"] = None
+            # 已收到的消息在恢复时一并确认，Agent 只需重传之后的消息
+            session["acked"] = session["received"]
+        if previous is not None and previous is not websocket:
+            await previous.close()
+        return session
+
+    def _release_session(self, websocket, session: dict):
+        """
+        连接断开后保留会话 session_ttl 秒。
+
+        :param websocket: WebSocket 连接对象
+        :param session: 会话状态
+        """
+        if session["websocket"] is not websocket:
+            return  # 会话已被新连接恢复
+        if session["timer"]:
+            session["timer"].cancel()
+            session["timer"] = None
+        session["websocket"] = None
+        session["expires"] = time.monotonic() + self.session_ttl
 
     async def _handle_connection(self, websocket):
         """
@@ -28,6 +154,8 @@ class WebSocketReceive:
         :param path: 请求路径
         """
         self.logger.info(f"New connection from {websocket.remote_address}")
+        ack_state = None
+        decompressor = None
         try:
             # 接收认证信息
             auth_message = await websocket.recv()
@@ -39,36 +167,131 @@ class WebSocketReceive:
                 await websocket.close()
                 return
 
-            # 认证成功
-            await websocket.send("authenticated")
-            self.logger.info(f"Client {websocket.remote_address} authenticated")
+            if "session" in auth_data:
+                # Agent 重连时携带会话令牌，恢复成功时不需要完整的认证信息
+                ack_state = await self._resume_session(websocket, auth_data["session"])
+                if ack_state:
+                    await websocket.send(json.dumps({
+                        "status": "resumed",
+                        "session": ack_state["token"],
+                        "ack": ack_state["acked"]
+                    }))
+                    self.logger.info(f"Client {websocket.remote_address} resumed session, "
+                                     f"acknowledged up to seq {ack_state['acked']}")
+                else:
+                    # 会话不存在（例如服务端重启过）。新版 Agent 收到后断开，随机等待后重新连接并完整认证；
+                    # 仍兼容在同一连接上发送完整认证信息的 Agent
+                    await websocket.send(json.dumps({"status": "session_unknown"}))
+                    auth_data = json.loads(await websocket.recv())
+                    if auth_data.get("secret") != self.secret or "encodings" not in auth_data:
+                        self.logger.error(f"Authentication failed from {websocket.remote_address}")
+                        await websocket.send("authentication_failed")
+                        await websocket.close()
+                        return
+
+            if ack_state:
+                legacy = False
+            elif "encodings" in auth_data:
+                # 认证成功，新版 Agent 在认证消息中提供支持的编码，由服务端选定，并分配会话令牌
+                ack_state = self._new_session(websocket, auth_data)
+                legacy = False
+                await websocket.send(json.dumps({
+                    "status": "authenticated",
+                    "encoding": ack_state["codec"].name,
+                    "compression": "deflate" if ack_state["decompressor"] else None,
+                    "session": ack_state["token"]
+                }))
+            else:
+                legacy = True  # 旧版 Agent 每条消息携带密钥
+                ack_state = {
+                    "received": 0, "acked": 0, "timer": None, "codec": JsonCodec(),
+                    "decompressor": None, "decoder": DeltaDecoder(), "host_facts": auth_data.get("host_facts"),
+                    "ip_address": None, "lock": asyncio.Lock()
+                }
+                await websocket.send("authenticated")
+            codec = ack_state["codec"]
+            decompressor = ack_state["decompressor"]
+            decoder = ack_state["decoder"]
+            self.logger.info(f"Client {websocket.remote_address} authenticated, using {codec.name} encoding")
 
             # 接收数据
             async for message in websocket:
-                try:
-                    data = json.loads(message)
-                    if data.get("secret") != self.secret:
-                        self.logger.error(f"Invalid secret from {websocket.remote_address}")
-                        await websocket.send("invalid_secret")
-                        continue
-
-                    # 将数据推入队列
-                    await self.data_queue.put(data["data"])
-                    self.logger.debug(f"Received data from {websocket.remote_address}: {data['data']}")
-
-                    # 发送确认
-                    await websocket.send("ack")
-                except json.JSONDecodeError:
-                    self.logger.error(f"Invalid JSON message from {websocket.remote_address}")
-                    await websocket.send("invalid_json")
-                except Exception as e:
-                    self.logger.error(f"Error processing message from {websocket.remote_address}: {e}")
-                    await websocket.send("error")
+                async with ack_state["lock"]:
+                    # 一条消息入队并推进 received 之前，会话恢复不会读取确认进度
+                    if not legacy and ack_state["websocket"] is not websocket:
+                        # 会话已被 Agent 的新连接恢复，关闭旧连接
+                        self.logger.info(f"Session taken over, closing stale connection from {websocket.remote_address}")
+                        await websocket.close()
+                        return
+                    try:
+                        if decompressor:
+                            message = decompressor.decompress(message)
+                        data = codec.decode(message)
+                        if legacy and data.get("secret") != self.secret:
+                            self.logger.error(f"Invalid secret from {websocket.remote_address}")
+                            await websocket.send("invalid_secret")
+                            continue
+
+                        if "facts" in data:
+                            # 会话中主机信息发生变化
+                            ack_state["host_facts"] = data["facts"]
+                            ack_state["ip_address"] = None
+                            self.logger.info(f"Host facts updated from {websocket.remote_address}")
+                            continue
+
+                        seq = data.get("seq")
+                        if seq is not None and seq <= ack_state["received"]:
+                            self.logger.debug("Duplicate message seq %s from %s", seq, websocket.remote_address)
+                        else:
+                            # 将数据推入队列（兼容单样本消息和批量消息）
+                            samples = data["batch"] if "batch" in data else [data["data"]]
+                            if data.get("delta"):
+                                try:
+                                    samples = [decoder.decode(entry) for entry in samples]
+                                except (ValueError, KeyError) as e:
+                                    # 无法还原时断开连接，Agent 重连后从关键帧重新发送未确认的消息
+                                    self.logger.error(f"Failed to decode delta from {websocket.remote_address}: {e}")
+                                    if not legacy:
+                                        # 会话中的解码状态已不可信，不允许恢复
+                                        self.sessions.pop(ack_state["token"], None)
+                                    await websocket.close()
+                                    return
+                            samples = [merge_host_facts(sample, ack_state["host_facts"]) for sample in samples]
+                            if samples and not ack_state["ip_address"]:
+                                # 每个会话（旧版 Agent 为每个连接）只计算一次 IP 地址，随样本传给 SystemInfoHandler
+                                ack_state["ip_address"] = get_ip_address(samples[0].get("network", {}))
+                            for sample in samples:
+                                await self.data_queue.put({**sample, "ip_address": ack_state["ip_address"]},
+                                                          source=ack_state["ip_address"])
+                            # 只记录样本数量，不格式化样本内容
+                            self.logger.debug("Received %d samples from %s", len(samples), websocket.remote_address)
+
+                        # 发送确认：旧版 Agent 逐条确认，带序列号的消息累计确认
+                        if seq is None:
+                            await websocket.send("ack")
+                        else:
+                            ack_state["received"] = max(ack_state["received"], seq)
+                            await self._schedule_ack(websocket, ack_state)
+                    except ValueError:
+                        self.logger.error(f"Invalid {codec.name} message from {websocket.remote_address}")
+                        await websocket.send("invalid_json" if legacy else "invalid_message")
+                    except Exception as e:
+                        self.logger.error(f"Error processing message from {websocket.remote_address}: {e}")
+                        await websocket.send("error")
 
         except websockets.exceptions.ConnectionClosed:
             self.logger.info(f"Client {websocket.remote_address} disconnected")
         except Exception as e:
             self.logger.error(f"Error handling connection from {websocket.remote_address}: {e}")
+        finally:
+            if ack_state:
+                if "token" in ack_state:
+                    self._release_session(websocket, ack_state)
+                elif ack_state["timer"]:
+                    ack_state["timer"].cancel()
+            if decompressor:
+                self.logger.info(f"Compression ratio {decompressor.ratio():.2f} from {websocket.remote_address} "
+                                 f"({decompressor.raw_bytes} -> {decompressor.compressed_bytes} bytes)")
 
     async def start(self):
         """
@@ -5,10 +5,12 @@ import websockets
 import json
 from collections import deque
 from Logger import Logger
-from ASDatebase import ASDatabase
+from ASDatebase import ASDatabase, ASDatabasePool
 from WebSocketReceive import WebSocketReceive
 from SystemInfoHandler import SystemInfoHandler
-from flask import Flask, jsonify, request
+from ChangeNotifier import ChangeNotifier
+from IngestQueue import IngestQueue
+from flask import Flask, Response, jsonify, request, stream_with_context
 import threading
 
 # 配置
@@ -18,6 +20,27 @@ SECRET = "your_secret_key"  # 用于验证客户端的密钥
 DB_PATH = "agent-server.db"  # SQLite 数据库文件路径
 FLASK_HOST = "0.0.0.0"  # Flask 服务器绑定的主机地址
 FLASK_PORT = 8888       # Flask 服务器绑定的端口
+ACK_EVERY = 4     # 每收到多少个消息发送一次累计确认
+ACK_DELAY = 0.2   # 累计确认的最长延迟（秒）
+SESSION_TTL = 300  # Agent 断线后会话保留的时间（秒）
+WRITE_BATCH_SIZE = 500    # 每个数据库事务最多写入的样本数
+WRITE_BATCH_DELAY = 0.05  # 凑齐一批样本的最长等待时间（秒）
+WRITE_QUEUE_SIZE = 64     # 等待写入线程处理的批次数上限
+DB_POOL_SIZE = 8          # Flask 查询使用的数据库连接数上限
+LAST_SEEN_INTERVAL = 10   # 服务器最后心跳时间的批量写入间隔（秒）
+PERFORMANCE_CHUNK_SIZE = 500  # /performance 流式响应每块的记录数
+PERFORMANCE_MAX_LIMIT = 5000  # /performance 按同步位置查询时每页最多返回的记录数
+STREAM_HEARTBEAT = 10     # /stream 没有新数据时发送同步标记的间隔（秒），用于检测断开的连接
+INGEST_QUEUE_SIZE = 10000  # 等待写入的样本数上限
+INGEST_POLICY = "delay_ack"  # 样本队列已满时的处理方式："delay_ack"、"coalesce" 或 "drop_oldest"
+# SQLite 连接参数，写入线程和查询连接池共用
+SQLITE_SETTINGS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000
+}
 
 # 日志配置
 LOG_CONFIG = {
@@ -29,17 +52,31 @@ LOG_CONFIG = {
         "maxBytes": 1024 * 1024 * 10,
         "backupCount": 5
     },
-    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s"
+    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s",
+    "async_logging": True  # 日志在后台线程中写入，不阻塞事件循环
 }
 
 # 创建 Logger 实例
 logger = Logger(**LOG_CONFIG)
 
-# 创建 asyncio.Queue 用于存储接收到的数据
-data_queue = asyncio.Queue()
+# 创建有界的样本队列用于存储接收到的数据
+data_queue = IngestQueue(maxsize=INGEST_QUEUE_SIZE, logger=logger, policy=INGEST_POLICY)
+
+# 写入线程提交数据后通知 /stream 的推送连接
+notifier = ChangeNotifier()
 
 # 创建 SystemInfoHandler 实例
-handler = SystemInfoHandler(data_queue=data_queue, db_path=DB_PATH, logger=logger)
+handler = SystemInfoHandler(
+    data_queue=data_queue,
+    db_path=DB_PATH,
+    logger=logger,
+    batch_size=WRITE_BATCH_SIZE,
+    batch_delay=WRITE_BATCH_DELAY,
+    write_queue_size=WRITE_QUEUE_SIZE,
+    db_settings=SQLITE_SETTINGS,
+    last_seen_interval=LAST_SEEN_INTERVAL,
+    notifier=notifier
+)
 
 # 创建 WebSocketReceive 实例
 ws_receiver = WebSocketReceive(
@@ -47,50 +84,131 @@ ws_receiver = WebSocketReceive(
     port=PORT,
     secret=SECRET,
     data_queue=data_queue,
-    logger=logger
+    logger=logger,
+    ack_every=ACK_EVERY,
+    ack_delay=ACK_DELAY,
+    session_ttl=SESSION_TTL
 )
 
 # 创建 Flask 应用
 app = Flask(__name__)
 
-def get_db():
-    """
-    获取当前线程的 SQLite 连接。
-    """
-    if not hasattr(threading.current_thread(), "db"):
-        threading.current_thread().db = ASDatabase(db_path=DB_PATH, logger=logger)
-        threading.current_thread().db.connect()
-    return threading.current_thread().db
+# Flask 请求线程共用的数据库连接池
+db_pool = ASDatabasePool(db_path=DB_PATH, logger=logger, size=DB_POOL_SIZE, settings=SQLITE_SETTINGS)
 
 @app.route("/servers", methods=["GET"])
 def get_servers():
     """
     获取已记录的服务器信息。
     """
-    db = get_db()
-    servers = db.get_servers()
+    with db_pool.connection() as db:
+        servers = db.get_servers()
     return jsonify(servers)
 
+@app.route("/ingest", methods=["GET"])
+def get_ingest_stats():
+    """
+    获取样本队列的深度和过载时各种处理结果的计数。
+    """
+    return jsonify(data_queue.stats())
+
 @app.route("/performance", methods=["GET"])
 def get_performance():
     """
-    获取指定时间段内所有服务器的性能信息。
+    获取所有服务器（或 server_ids 指定的服务器，逗号分隔）的性能信息，两种查询方式：
+
+    - start_time、end_time：指定时间段内的记录；
+    - after、limit：ID 大于 after 的最多 limit 条记录，按 ID 排序，用于增量同步，
+      下一页的 after 为本页最后一条记录的 ID，返回记录数少于 limit 时已同步到最新。
+
+    结果以 JSON 数组分块流式返回，不在内存中构建完整的响应。
     """
-    db = get_db()
     start_time = request.args.get("start_time")
     end_time = request.args.get("end_time")
-    if not start_time or not end_time:
-        return jsonify({"error": "start_time and end_time are required"}), 400
-
-    performance_data = []
-    servers = db.get_servers()
-    for server in servers:
-        logger.debug(server)
-        server_id = server["id"]
-        data = db.get_performance_data(server_id=server_id, start_time=start_time, end_time=end_time)
-        performance_data.extend(data)
-
-    return jsonify(performance_data)
+    after = request.args.get("after")
+    if after is None and (not start_time or not end_time):
+        return jsonify({"error": "after or start_time and end_time are required"}), 400
+    if after is not None:
+        try:
+            after = int(after)
+            limit = min(int(request.args.get("limit", PERFORMANCE_MAX_LIMIT)), PERFORMANCE_MAX_LIMIT)
+            if after < 0 or limit < 1:
+                # SQLite 的 LIMIT 为负数时不限制记录数
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "after must be a non-negative integer and limit a positive integer"}), 400
+    server_ids = None
+    if request.args.get("server_ids"):
+        try:
+            server_ids = [int(server_id) for server_id in request.args["server_ids"].split(",")]
+        except ValueError:
+            return jsonify({"error": "server_ids must be a comma-separated list of integers"}), 400
+
+    def generate():
+        # 连接在整个响应期间借出，响应结束（或客户端断开）时归还
+        with db_pool.connection() as db:
+            separator = "["
+            if after is not None:
+                chunks = db.iter_performance_after(after, limit, server_ids, PERFORMANCE_CHUNK_SIZE)
+            else:
+                chunks = db.iter_performance_data(start_time, end_time, server_ids, PERFORMANCE_CHUNK_SIZE)
+            for chunk in chunks:
+                yield separator + ",".join(json.dumps(record) for record in chunk)
+                separator = ","
+            yield "]" if separator == "," else "[]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """
+    推送新提交的性能数据和服务器信息变化，以换行分隔的 JSON（NDJSON）持续返回，每行一个事件：
+
+    - {"type": "server", "data": 服务器记录}：新服务器，或状态、最后心跳时间发生变化的服务器；
+    - {"type": "performance", "data": 性能记录}：ID 大于同步位置的性能记录，按 ID 排序；
+    - {"type": "sync", "cursor": 同步位置}：之前的事件已全部发送，接收方可以保存同步位置。
+      没有新数据时每 STREAM_HEARTBEAT 秒发送一次。
+
+    连接断开后以最后收到的同步位置作为 after 重新连接即可继续，不会遗漏或重复。
+    可选参数 server_ids 只推送指定服务器的性能记录（逗号分隔）。
+    """
+    try:
+        after = int(request.args.get("after", 0))
+        if after < 0:
+            raise ValueError
+        server_ids = [int(server_id) for server_id in request.args["server_ids"].split(",")] \
+            if request.args.get("server_ids") else None
+    except ValueError:
+        return jsonify({"error": "after must be a non-negative integer and server_ids a comma-separated list of integers"}), 400
+
+    def generate():
+        cursor = after
+        sent_servers = {}  # 服务器 ID -> 已推送的 (状态, 最后心跳时间)
+        version = notifier.version
+        while True:
+            lines = []
+            # 每次查询时才借出连接，推送连接不长期占用连接池
+            with db_pool.connection() as db:
+                for server in db.get_servers():
+                    state = (server["status"], server["last_seen"])
+                    if sent_servers.get(server["id"]) != state:
+                        sent_servers[server["id"]] = state
+                        lines.append(json.dumps({"type": "server", "data": server}))
+                records = [record for chunk in db.iter_performance_after(cursor, PERFORMANCE_MAX_LIMIT, server_ids,
+                                                                         PERFORMANCE_CHUNK_SIZE)
+                           for record in chunk]
+            for record in records:
+                lines.append(json.dumps({"type": "performance", "data": record}))
+            if records:
+                cursor = records[-1]["id"]
+            lines.append(json.dumps({"type": "sync", "cursor": cursor}))
+            yield "\n".join(lines) + "\n"
+            if len(records) < PERFORMANCE_MAX_LIMIT:
+                # 已发送到最新，等待新的提交
+                version = notifier.wait(version, STREAM_HEARTBEAT)
+
+    logger.info(f"Stream subscribed from {request.remote_addr} after ID {after}")
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 def start_flask_server():
     """
@@ -1,14 +1,19 @@
 import requests
 from typing import List, Dict, Optional
 from datetime import datetime
-from USDatabase import USDatabase
+from USDatabase import USDatabase, METRIC_COLUMNS
 from Logger import Logger
+import json
 import requests
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime
+import time
+
+SYNC_STATE_PERFORMANCE = "performance_data"  # sync_state 表中性能数据同步位置的名称
 
 class AgentDataRequest:
-    def __init__(self, server_address: str, server_port: int, db: USDatabase, logger: Logger):
+    def __init__(self, server_address: str, server_port: int, db: USDatabase, logger: Logger, page_size: int = 1000,
+                 unknown_server_timeout: float = 300):
         """
         初始化 AgentDataRequest 类。
 
@@ -16,10 +21,17 @@ class AgentDataRequest:
         :param server_port: 监控数据收集服务器的端口
         :param db: 数据库实例
         :param logger: 日志记录器实例
+        :param page_size: 增量同步性能数据时每页的记录数
+        :param unknown_server_timeout: 性能数据所属的服务器一直没有同步到本地时，最多等待的时间（秒），超时后跳过这些记录
         """
         self.server_url = f"http://{server_address}:{server_port}"
         self.db = db
         self.logger = logger
+        self.page_size = page_size
+        self.cursor = None  # 已同步的最大性能记录 ID，首次同步时从数据库读取
+        self.synced_until = {}  # 首次同步时仍需跳过的旧数据：服务器 ID -> 本地已有的最新时间戳
+        self.unknown_server_timeout = unknown_server_timeout
+        self.unknown_servers = {}  # 本地还没有的服务器（监控收集服务器上的 ID）-> 首次遇到的时间
 
     def request_servers(self) -> Optional[List[Dict]]:
         """
@@ -39,7 +51,7 @@ class AgentDataRequest:
 
     def handle_servers(self, servers: List[Dict]) -> List[Dict]:
         """
-        处理服务器信息，更新已存在记录的 `last_seen` 字段。
+        处理服务器信息，按 IP 地址更新已存在记录的 `last_seen` 字段和监控收集服务器上的服务器 ID。
 
         :param servers: 从监控服务器获取的服务器信息
         :return: 处理后的服务器信息列表
@@ -49,10 +61,10 @@ class AgentDataRequest:
             self.db.execute_query(
                 """
                 UPDATE servers
-                SET last_seen = ?
+                SET last_seen = ?, ingest_id = ?
                 WHERE ip_address = ?
                 """,
-                (server["last_seen"], server["ip_address"])
+                (server["last_seen"], server.get("id"), server["ip_address"])
             )
             self.logger.debug(f"Updated last_seen for server: ip_address={server['ip_address']}")
 
@@ -68,8 +80,8 @@ class AgentDataRequest:
             self.db.execute_query(
                 """
                 INSERT INTO servers (
-                    server_name, platform, version, ip_address, status, last_seen, server_notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    server_name, platform, version, ip_address, status, last_seen, server_notes, ingest_id
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     server["server_name"],
@@ -78,7 +90,8 @@ class AgentDataRequest:
                     server["ip_address"],
                     server["status"],
                     server["last_seen"],
-                    server["server_notes"]
+                    server["server_notes"],
+                    server.get("id")
                 )
             )
         self.logger.info(f"Inserted {len(servers)} new server records into the database.")
@@ -92,7 +105,15 @@ class AgentDataRequest:
         if not servers:
             self.logger.error("No server data fetched.")
             return
+        return self.store_servers(servers)
+
+    def store_servers(self, servers: List[Dict]) -> List[Dict]:
+        """
+        更新已存在服务器的 `last_seen` 字段，插入新服务器。
 
+        :param servers: 从监控服务器获取的服务器信息
+        :return: 新插入的服务器信息列表
+        """
         # 处理数据，更新 `last_seen` 字段
         self.handle_servers(servers)
 
@@ -116,104 +137,213 @@ class AgentDataRequest:
         return new_servers
         
 
-    def request_performance_data(self, start_time: str, end_time: str) -> Optional[List[Dict]]:
+    def _load_cursor(self) -> int:
+        """
+        读取保存的性能数据同步位置。
+
+        首次使用时（没有保存的同步位置）从头同步，数据库中已有按时间段同步的旧数据时，
+        跳过每个服务器最后一条记录及之前的数据，直到收到该服务器更新的数据；
+        跳过状态与同步位置一起保存，同步中途重启也不会重复插入。
+
+        :return: 已同步的最大性能记录 ID（监控收集服务器上的 ID）
+        """
+        state = self.db.execute_query(
+            "SELECT value, skip_until FROM sync_state WHERE name = ?", (SYNC_STATE_PERFORMANCE,), fetch=True
+        )
+        if state:
+            skip_until = json.loads(state[0]["skip_until"]) if state[0]["skip_until"] else {}
+            self.synced_until = {int(server_id): timestamp for server_id, timestamp in skip_until.items()}
+            return state[0]["value"]
+        latest = self.db.execute_query(
+            "SELECT server_id, MAX(timestamp) AS timestamp FROM performance_data GROUP BY server_id", fetch=True
+        ) or []
+        self.synced_until = {row["server_id"]: row["timestamp"] for row in latest}
+        self.logger.info(f"No sync cursor saved, starting from the beginning ({len(latest)} servers already have data)")
+        return 0
+
+    def request_performance_data(self, after: int, limit: int) -> Optional[List[Dict]]:
         """
-        请求监控数据收集服务器的性能数据。
+        请求监控数据收集服务器上 ID 大于 after 的性能数据，按 ID 排序。
 
-        :param start_time: 开始时间（格式：'YYYY-MM-DD HH:MM:SS'）
-        :param end_time: 结束时间（格式：'YYYY-MM-DD HH:MM:SS'）
+        :param after: 同步位置
+        :param limit: 最多返回的记录数
         :return: 性能数据列表
         """
         try:
-            params = {"start_time": start_time, "end_time": end_time}
+            params = {"after": after, "limit": limit}
             response = requests.get(f"{self.server_url}/performance", params=params)
             response.raise_for_status()
             performance_data = response.json()
-            self.logger.info(f"Successfully fetched performance data from {start_time} to {end_time}.")
+            self.logger.debug(f"Fetched {len(performance_data)} performance records after ID {after}.")
             return performance_data
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error requesting performance data: {e}")
             return None
 
-    def handle_performance_data(self, performance_data: List[Dict]) -> List[Dict]:
+    def handle_performance_data(self, performance_data: List[Dict]) -> Tuple[List[Dict], Optional[int], Dict]:
         """
-        处理性能数据，过滤掉重复记录。
+        处理性能数据：按监控收集服务器上的服务器 ID 换成本地的服务器 ID，过滤掉首次同步前已有的记录。
+
+        遇到本地还没有的服务器（服务器信息尚未同步）时在该记录之前截断，之后的记录在同步服务器信息后重新获取，
+        不会因为跳过而丢失；同一个服务器超过 unknown_server_timeout 秒仍未同步到本地时，跳过它的记录。
 
         :param performance_data: 从监控服务器获取的性能数据
-        :return: 去重后的性能数据列表
+        :return: (需要插入的性能数据列表, 已处理的最后一条记录的 ID（第一条记录就被截断时为 None）,
+                 处理后的首次同步跳过状态)，同步位置和跳过状态在插入成功后才生效
         """
+        local_ids = {
+            row["ingest_id"]: row["id"]
+            for row in self.db.execute_query(
+                "SELECT id, ingest_id FROM servers WHERE ingest_id IS NOT NULL", fetch=True
+            ) or []
+        }
+        synced_until = dict(self.synced_until)
         new_data = []
+        cursor = None
+        now = time.monotonic()
+        skipped = {}  # 本页跳过的记录数：服务器 ID（监控收集服务器上的）-> 记录数
         for record in performance_data:
-            # 获取服务器 IP 地址
-            server_id = record["server_id"]
-            server = self.db.execute_query("SELECT ip_address FROM servers WHERE id = ?", (server_id,), fetch=True)
-            if not server:
-                self.logger.warning(f"Server with ID {server_id} not found in database.")
+            server_id = local_ids.get(record["server_id"])
+            if server_id is None:
+                first_seen = self.unknown_servers.setdefault(record["server_id"], now)
+                if now - first_seen < self.unknown_server_timeout:
+                    self.logger.warning(f"Server with ID {record['server_id']} not found in database, "
+                                        f"stopping sync before record {record['id']} until servers are synced.")
+                    break
+                skipped[record["server_id"]] = skipped.get(record["server_id"], 0) + 1
+                cursor = record["id"]
                 continue
-            server_ip = server[0]["ip_address"]
-
-            # 检查是否已存在相同记录
-            exists = self.db.execute_query(
-                """
-                SELECT 1 FROM performance_data
-                WHERE server_id = ? AND timestamp = ?
-                """,
-                (server_id, record["timestamp"]),
-                fetch=True
-            )
-            if not exists:
-                new_data.append({**record, "server_ip": server_ip})
-            else:
-                self.logger.debug(f"Duplicate record skipped: server_id={server_id}, timestamp={record['timestamp']}")
-        return new_data
+            self.unknown_servers.pop(record["server_id"], None)
+            record = {**record, "server_id": server_id}
+            cursor = record["id"]
+            skip_until = synced_until.get(server_id)
+            if skip_until is not None:
+                if record["timestamp"] <= skip_until:
+                    continue
+                del synced_until[server_id]  # 已经收到该服务器更新的数据，之后不再跳过
+            new_data.append(record)
+        for server_id, count in skipped.items():
+            self.logger.warning(f"Server with ID {server_id} still not found in database after "
+                                f"{self.unknown_server_timeout}s, skipped {count} records.")
+        return new_data, cursor, synced_until
 
-    def insert_performance_data(self, performance_data: List[Dict]):
+    def insert_performance_data(self, performance_data: List[Dict], cursor: int, synced_until: Dict) -> bool:
         """
-        将性能数据插入数据库。
+        将性能数据插入数据库，并在同一个事务中保存同步位置和首次同步跳过状态。
 
-        :param performance_data: 去重后的性能数据列表
+        :param performance_data: 需要插入的性能数据列表
+        :param cursor: 本页最后一条记录的 ID
+        :param synced_until: handle_performance_data 返回的跳过状态
+        :return: 是否插入成功
         """
-        for record in performance_data:
-            self.db.execute_query(
-                """
+        inserted = self.db.execute_transaction([
+            (
+                f"""
                 INSERT INTO performance_data (
-                    server_id, timestamp, cpu_info, memory_info, disk_info, network_info, boot_time, processes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    server_id, timestamp, cpu_info, memory_info, disk_info, network_info, boot_time, processes, disk_io_info,
+                    {', '.join(METRIC_COLUMNS)}
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (
-                    record["server_id"],
-                    record["timestamp"],
-                    record["cpu_info"],
-                    record["memory_info"],
-                    record["disk_info"],
-                    record["network_info"],
-                    record["boot_time"],
-                    record["processes"]
-                )
+                [
+                    (
+                        record["server_id"],
+                        record["timestamp"],
+                        record["cpu_info"],
+                        record["memory_info"],
+                        record["disk_info"],
+                        record["network_info"],
+                        record["boot_time"],
+                        record["processes"],
+                        record.get("disk_io_info"),  # 旧版监控服务器不提供
+                        *(record.get(column) for column in METRIC_COLUMNS)
+                    )
+                    for record in performance_data
+                ]
+            ),
+            (
+                "INSERT OR REPLACE INTO sync_state (name, value, skip_until) VALUES (?, ?, ?)",
+                [(SYNC_STATE_PERFORMANCE, cursor, json.dumps(synced_until) if synced_until else None)]
             )
-        self.logger.info(f"Inserted {len(performance_data)} new performance records into the database.")
+        ])
+        if inserted:
+            self.logger.info(f"Inserted {len(performance_data)} new performance records into the database.")
+        return inserted
 
-    def fetch_and_store_performance_data(self, start_time: str, end_time: str):
+    def fetch_and_store_performance_data(self) -> List[Dict]:
         """
-        从监控服务器获取性能数据并存储到数据库。
+        从监控服务器分页获取上次同步位置之后的性能数据并存储到数据库，直到同步到最新。
 
-        :param start_time: 开始时间（格式：'YYYY-MM-DD HH:MM:SS'）
-        :param end_time: 结束时间（格式：'YYYY-MM-DD HH:MM:SS'）
+        :return: 新插入的性能数据列表
         """
-        # 请求性能数据
-        performance_data = self.request_performance_data(start_time, end_time)
-        # self.logger.debug(f"New performance data is {performance_data}")
-        if not performance_data:
-            self.logger.error("No performance data fetched.")
-            return
+        if self.cursor is None:
+            self.cursor = self._load_cursor()
+        stored = []
+        while True:
+            performance_data = self.request_performance_data(self.cursor, self.page_size)
+            if not performance_data:
+                break
+            new_data, cursor, synced_until = self.handle_performance_data(performance_data)
+            if cursor is None:
+                break  # 服务器信息尚未同步，下次重新获取这一页
+            if not self.insert_performance_data(new_data, cursor, synced_until):
+                break  # 同步位置未移动，下次重新获取这一页
+            self.cursor = cursor
+            self.synced_until = synced_until
+            stored.extend(new_data)
+            if cursor != performance_data[-1]["id"] or len(performance_data) < self.page_size:
+                break
+        return stored
 
-        # 处理数据，去重
-        new_data = self.handle_performance_data(performance_data)
-        if not new_data:
-            self.logger.info("No new performance data to insert.")
-            return
-        # self.logger.debug(f"New performance data fetch: {new_data}")
+    def stream_data(self, on_performance_data: Callable[[List[Dict]], None] = None, read_timeout: float = 30) -> bool:
+        """
+        订阅监控服务器的推送（/stream），从同步位置开始接收新的性能数据和服务器信息变化并存储到数据库，
+        直到连接断开。每收到一个同步标记，在一个事务中插入之前收到的性能数据并保存同步位置。
 
-        # 插入新数据
-        self.insert_performance_data(new_data)
-        return new_data
\ No newline at end of file
+        :param on_performance_data: 每次插入新性能数据后调用，参数为新插入的性能数据列表
+        :param read_timeout: 超过该时间没有收到任何数据（监控服务器定期发送同步标记）时视为连接已断开（秒）
+        :return: 是否建立了推送连接，监控服务器不支持推送时返回 False，调用方应改为轮询
+        """
+        if self.cursor is None:
+            self.cursor = self._load_cursor()
+        try:
+            response = requests.get(f"{self.server_url}/stream", params={"after": self.cursor}, stream=True,
+                                    timeout=(read_timeout, read_timeout))
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error subscribing to monitoring server stream: {e}")
+            return False
+        self.logger.info(f"Subscribed to monitoring server stream after ID {self.cursor}.")
+
+        servers, performance_data = [], []
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "server":
+                        servers.append(event["data"])
+                    elif event["type"] == "performance":
+                        performance_data.append(event["data"])
+                    elif event["type"] == "sync":
+                        if servers:
+                            self.store_servers(servers)
+                            servers = []
+                        if event["cursor"] != self.cursor:
+                            new_data, cursor, synced_until = self.handle_performance_data(performance_data)
+                            truncated = bool(performance_data) and cursor != performance_data[-1]["id"]
+                            if not truncated:
+                                cursor = event["cursor"]
+                            if cursor is not None:
+                                if not self.insert_performance_data(new_data, cursor, synced_until):
+                                    break  # 同步位置未移动，重新连接后从同步位置重新接收
+                                self.cursor = cursor
+                                self.synced_until = synced_until
+                                if new_data and on_performance_data:
+                                    on_performance_data(new_data)
+                            if truncated:
+                                break  # 重新连接前先同步服务器信息，再从同步位置继续接收
+                        performance_data = []
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            self.logger.error(f"Monitoring server stream interrupted: {e}")
+        return True
@@ -1,7 +1,29 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from typing import Optional, Dict
 
+class _DroppingQueueHandler(QueueHandler):
+    """
+    日志队列满时丢弃记录而不是阻塞调用方，格式化推迟到后台线程中进行。
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0  # 因队列满而丢弃的日志数
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 记录在同一进程内传递，不需要像默认实现那样提前格式化
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 class Logger:
     def __init__(
         self,
@@ -11,6 +33,8 @@ class Logger:
         console: bool = True,
         file_rotation: Optional[Dict] = None,
         formatter: Optional[str] = None,
+        async_logging: bool = False,
+        queue_size: int = 10000,
     ):
         """
         初始化日志包装器
@@ -21,6 +45,8 @@ class Logger:
         :param console: 是否输出到控制台
         :param file_rotation: 日志轮转配置（格式：{'maxBytes': 1024*1024*5, 'backupCount': 3}）
         :param formatter: 自定义日志格式字符串
+        :param async_logging: 是否异步写日志：调用方只把记录放入队列，由后台线程格式化并写入控制台和文件
+        :param queue_size: 异步日志队列的容量，队列满时丢弃新的日志
         """
 
         self.logger = logging.getLogger(name)
@@ -34,11 +60,13 @@ class Logger:
                 "[%(asctime)s] [%(levelname)s] [%(module)s] [%(funcName)s] - %(message)s"
             )
 
+        handlers = []
+
         # 添加控制台 handler
         if console:
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(self.formatter)
-            self.logger.addHandler(console_handler)
+            handlers.append(console_handler)
 
         # 添加文件 handler（带轮转）
         if log_file:
@@ -52,11 +80,26 @@ class Logger:
                 file_handler = logging.FileHandler(log_file)
 
             file_handler.setFormatter(self.formatter)
-            self.logger.addHandler(file_handler)
+            handlers.append(file_handler)
+
+        self.queue_handler = None
+        self.listener = None
+        if async_logging and handlers:
+            self.queue_handler = _DroppingQueueHandler(queue.Queue(queue_size))
+            self.listener = QueueListener(self.queue_handler.queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.listener.stop)  # 退出前写完队列中剩余的日志
+            self.logger.addHandler(self.queue_handler)
+        else:
+            for handler in handlers:
+                self.logger.addHandler(handler)
 
         # 保证每个 logger 只添加一次 handler
         self.logger.propagate = False
 
+        self._adapter = logging.LoggerAdapter(self.logger, {})  # 无上下文时复用
+        self._last_logged = {}  # 限频日志：消息模板 -> (上次输出时间, 期间被抑制的次数)
+
     def get_logger(self, context: Optional[Dict] = None) -> logging.LoggerAdapter:
         """
         获取带有上下文信息的 LoggerAdapter
@@ -64,19 +107,62 @@ class Logger:
         :param context: 上下文信息（如 user_id: "12345"）
         :return: LoggerAdapter 实例
         """
-        return logging.LoggerAdapter(self.logger, context or {})
+        if not context:
+            return self._adapter
+        return logging.LoggerAdapter(self.logger, context)
 
-    def info(self, message: str, context: Optional[Dict] = None):
-        self.get_logger(context).info(message)
+    def dropped(self) -> int:
+        """
+        返回异步日志队列满时丢弃的日志数。
+        """
+        return self.queue_handler.dropped if self.queue_handler else 0
+
+    # 消息可以使用 % 占位符并把参数放在 args 中，日志级别未启用时不会格式化
+    def info(self, message: str, *args, context: Optional[Dict] = None):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.get_logger(context).info(message, *args)
+
+    def debug(self, message: str, *args, context: Optional[Dict] = None):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.get_logger(context).debug(message, *args)
+
+    def warning(self, message: str, *args, context: Optional[Dict] = None):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.get_logger(context).warning(message, *args)
 
-    def debug(self, message: str, context: Optional[Dict] = None):
-        self.get_logger(context).debug(message)
+    def error(self, message: str, *args, context: Optional[Dict] = None):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.get_logger(context).error(message, *args)
 
-    def warning(self, message: str, context: Optional[Dict] = None):
-        self.get_logger(context).warning(message)
+    def critical(self, message: str, *args, context: Optional[Dict] = None):
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self.get_logger(context).critical(message, *args)
 
-    def error(self, message: str, context: Optional[Dict] = None):
-        self.get_logger(context).error(message)
+    def exception(self, message: str, *args, context: Optional[Dict] = None):
+        # 在 except 块中调用，附带异常的堆栈
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.get_logger(context).exception(message, *args)
 
-    def critical(self, message: str, context: Optional[Dict] = None):
-        self.get_logger(context).critical(message)
\ No newline at end of file
+    def log_every(self, interval: float, level: int, message: str, *args):
+        """
+        限频日志：同一消息模板每 interval 秒最多输出一次，并附带期间被抑制的次数。
+        用于每条消息、每个样本都会执行的热路径。
+
+        :param interval: 最短输出间隔（秒）
+        :param level: 日志级别（如 logging.INFO）
+        :param message: 消息模板（% 占位符）
+        :param args: 模板参数
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        last, suppressed = self._last_logged.get(message, (None, 0))
+        if last is not None and now - last < interval:
+            # 并发调用时计数可能略有偏差，不影响输出
+            self._last_logged[message] = (last, suppressed + 1)
+            return
+        self._last_logged[message] = (now, 0)
+        if suppressed:
+            self._adapter.log(level, message + " (%d similar messages suppressed)", *args, suppressed)
+        else:
+            self._adapter.log(level, message, *args)
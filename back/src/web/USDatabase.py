@@ -4,6 +4,16 @@ from typing import List, Dict, Optional, Any
 from Logger import Logger
 import json
 
+# performance_data 中的数值列：列名 -> 从 JSON 列回填旧数据的表达式
+# Web 服务器与监控收集服务器分开部署，须与 server/ASDatebase.py 中的 METRIC_COLUMNS 保持一致
+METRIC_COLUMNS = {
+    "cpu_percent": "json_extract(cpu_info, '$.percent_usage')",
+    "memory_percent": "json_extract(memory_info, '$.percent')",
+    "disk_max_percent": "(SELECT MAX(json_extract(value, '$.percent')) FROM json_each(disk_info))",
+    "net_upload_speed": "(SELECT SUM(json_extract(value, '$.io_stats.upload_speed')) FROM json_each(network_info))",
+    "net_download_speed": "(SELECT SUM(json_extract(value, '$.io_stats.download_speed')) FROM json_each(network_info))"
+}
+
 class USDatabase:
     def __init__(self, db_path: str, logger: Logger):
         """
@@ -16,6 +26,25 @@ class USDatabase:
         self.lock = threading.Lock()  # 用于线程安全的锁
         self._initialize_db()
 
+    def _migrate_performance_data(self, cursor: sqlite3.Cursor):
+        """
+        为旧版数据库补充新增的列，并从 JSON 列回填数值列（与监控收集服务器的迁移相同）。
+
+        :param cursor: 数据库游标
+        """
+        cursor.execute("PRAGMA table_info(performance_data)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "disk_io_info" not in columns:
+            cursor.execute("ALTER TABLE performance_data ADD COLUMN disk_io_info TEXT")
+        added = [column for column in METRIC_COLUMNS if column not in columns]
+        for column in added:
+            cursor.execute(f"ALTER TABLE performance_data ADD COLUMN {column} REAL")
+        if added:
+            cursor.execute(
+                f"UPDATE performance_data SET {', '.join(f'{column} = {METRIC_COLUMNS[column]}' for column in added)}"
+            )
+            self.logger.info(f"Migrated performance_data: added {', '.join(added)} ({cursor.rowcount} rows backfilled)")
+
     def _initialize_db(self):
         """
         初始化数据库表结构。
@@ -60,9 +89,15 @@ class USDatabase:
                         ip_address VARCHAR(15) NOT NULL,
                         status VARCHAR(50) NOT NULL,
                         last_seen DATETIME NOT NULL,
-                        server_notes TEXT
+                        server_notes TEXT,
+                        ingest_id INTEGER
                     )
                 """)
+                # 监控收集服务器上的服务器 ID，两边的 ID 各自自增，性能数据按该列对应到本地的服务器
+                cursor.execute("PRAGMA table_info(servers)")
+                if "ingest_id" not in {row[1] for row in cursor.fetchall()}:
+                    cursor.execute("ALTER TABLE servers ADD COLUMN ingest_id INTEGER")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_servers_ingest_id ON servers (ingest_id)")
 
                 # 创建性能数据表
                 cursor.execute("""
@@ -76,10 +111,35 @@ class USDatabase:
                         network_info TEXT NOT NULL,
                         boot_time DATETIME NOT NULL,
                         processes TEXT NOT NULL,
+                        disk_io_info TEXT,
+                        cpu_percent REAL,
+                        memory_percent REAL,
+                        disk_max_percent REAL,
+                        net_upload_speed REAL,
+                        net_download_speed REAL,
                         FOREIGN KEY (server_id) REFERENCES servers(id)
                     )
                 """)
 
+                self._migrate_performance_data(cursor)
+
+                # 按服务器和时间范围查询的索引
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_performance_server_time ON performance_data (server_id, timestamp)
+                """)
+
+                # 创建同步状态表，保存从监控收集服务器增量同步的位置
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS sync_state (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL,
+                        skip_until TEXT
+                    )
+                """)
+                cursor.execute("PRAGMA table_info(sync_state)")
+                if "skip_until" not in {row[1] for row in cursor.fetchall()}:
+                    cursor.execute("ALTER TABLE sync_state ADD COLUMN skip_until TEXT")
+
                 # 创建报警信息表
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS alerts (
@@ -130,6 +190,30 @@ class USDatabase:
                 if conn:
                     conn.close()
 
+    def execute_transaction(self, statements: List[tuple]) -> bool:
+        """
+        在一个事务中执行多条语句，全部成功后提交一次，任一失败时回滚。
+        :param statements: (SQL 语句, 参数列表) 的列表，每条语句对参数列表中的每组参数各执行一次
+        :return: 是否执行成功
+        """
+        with self.lock:
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db_path)
+                for query, params_list in statements:
+                    conn.executemany(query, params_list)
+                conn.commit()
+                self.logger.debug(f"Transaction of {len(statements)} statements executed successfully")
+                return True
+            except sqlite3.Error as e:
+                if conn:
+                    conn.rollback()
+                self.logger.error(f"Error executing transaction: {e}")
+                return False
+            finally:
+                if conn:
+                    conn.close()
+
     def add_alert(self, server_id: int, cpu_alert: Dict, memory_alert: Dict, disk_alert: Dict, network_alert: Dict) -> Optional[int]:
         """
         插入一条报警记录。
@@ -27,6 +27,10 @@ FLASK_HOST = "0.0.0.0"  # Flask 服务器绑定的主机地址
 FLASK_PORT = 7777       # Flask 服务器绑定的端口
 
 AGENT_DATA_UPDATE_INT = 3
+AGENT_DATA_PAGE_SIZE = 1000  # 增量同步性能数据时每页的记录数
+AGENT_DATA_UNKNOWN_SERVER_TIMEOUT = 300  # 性能数据所属的服务器一直没有同步到本地时，最多等待该时间后跳过这些记录（秒）
+AGENT_DATA_STREAM = True  # 订阅监控数据收集服务器的推送，监控服务器不支持时退回按 AGENT_DATA_UPDATE_INT 轮询
+AGENT_DATA_STREAM_TIMEOUT = 30  # 推送连接超过该时间没有收到数据时重新连接（秒）
 WS_DATA_SENT_INT = 3
 
 # 初始化日志记录器
@@ -39,7 +43,8 @@ LOG_CONFIG = {
         "maxBytes": 1024 * 1024 * 10,
         "backupCount": 5
     },
-    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s"
+    "formatter": "[%(asctime)s]-[%(levelname)s]: %(message)s",
+    "async_logging": True  # 日志在后台线程中写入，不阻塞事件循环
 }
 
 # 创建 Logger 实例
@@ -48,26 +53,30 @@ logger = Logger(**LOG_CONFIG)
 # 初始化数据库
 db = USDatabase(DB_PATH, logger)
 
-agent = AgentDataRequest(AS_HOST, AS_PORT, db, logger)
+agent = AgentDataRequest(AS_HOST, AS_PORT, db, logger, page_size=AGENT_DATA_PAGE_SIZE,
+                         unknown_server_timeout=AGENT_DATA_UNKNOWN_SERVER_TIMEOUT)
 
 monitor = PerformanceMonitor(logger, db, config_path=THRESHOLD_CONDIG)
 
+def save_alerts(performance_data):
+    for data in performance_data:
+        monitor.save_alert_to_db(data)
+
 def agent_data_update():
     while True:
         try:
             # 获取并存储服务器信息
             agent.fetch_and_store_servers()
 
-            end_time = datetime.now(timezone.utc)
-            start_time = end_time - timedelta(seconds=AGENT_DATA_UPDATE_INT)
-            start_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
-            end_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
-            agent.fetch_and_store_servers()
-            new_performance_data = agent.fetch_and_store_performance_data(start_str, end_str)
-            for data in new_performance_data:
-                monitor.save_alert_to_db(data)
+            if AGENT_DATA_STREAM and agent.stream_data(save_alerts, AGENT_DATA_STREAM_TIMEOUT):
+                # 推送连接断开，稍后从同步位置重新订阅
+                logger.info(f"Agent data stream closed, resubscribing in {AGENT_DATA_UPDATE_INT}s")
+            else:
+                # 从上次同步位置开始增量获取性能数据
+                save_alerts(agent.fetch_and_store_performance_data())
 
-            logger.info(f"Agent data updating finished, next updating time is {end_time + timedelta(seconds=AGENT_DATA_UPDATE_INT)}")
+                next_time = datetime.now(timezone.utc) + timedelta(seconds=AGENT_DATA_UPDATE_INT)
+                logger.info(f"Agent data updating finished, next updating time is {next_time}")
         except Exception as e:
             logger.error(f"Agent data updating failed: {e}")
         time.sleep(AGENT_DATA_UPDATE_INT)
@@ -243,7 +252,9 @@ def get_performance_data():
         query = """
             SELECT id, server_id, timestamp, 
                    cpu_info, memory_info, disk_info, 
-                   network_info, boot_time, processes
+                   network_info, boot_time, processes, disk_io_info,
+                   cpu_percent, memory_percent, disk_max_percent,
+                   net_upload_speed, net_download_speed
             FROM performance_data
             WHERE server_id = ? 
             AND timestamp BETWEEN ? AND ?
@@ -257,7 +268,7 @@ def get_performance_data():
         for record in results:
             formatted = dict(record)
             # 转换所有JSON字符串字段为字典
-            for json_field in ['cpu_info', 'memory_info', 'disk_info', 'network_info', 'processes']:
+            for json_field in ['cpu_info', 'memory_info', 'disk_info', 'network_info', 'processes', 'disk_io_info']:
                 if formatted.get(json_field):
                     formatted[json_field] = json.loads(formatted[json_field])
             formatted_results.append(formatted)